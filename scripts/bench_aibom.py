@@ -0,0 +1,523 @@
+"""
+process_aibom.py 性能基准
+
+## 场景
+- **standalone**: 单个超大文件，大量嵌套的 standalone 标记（`// @generated-ai` 单独一行），
+  分别在 25k / 50k / 100k 行上计时 analyze_content，校验单行耗时随规模基本不变（线性）
+- **regress**: 正确性回归（退出码 1 表示失败）
+  - diff 中类型变更（文件 → 符号链接）之后的文件，新增行与 AI 明细仍归属到正确的文件
+  - diff 解析边界：带修改的重命名、二进制文件、删除、路径含空格 / 引号 / 非 ASCII 字符
+  - roots 为 "." 时工作区、目录遍历、--ref 与 --commit 得到相同的文件集合
+  - 注释词法分析：字符串、模板字符串、HTML/Vue 文本中的标记不计入，SCSS 块注释按 standalone 处理（输入 → ai_ranges）
+  - 长行中大量未闭合的正则字面量 / 字符类不退化为二次方扫描
+- **tree**: 生成合成 src/ 目录与两提交的 git 历史（base → head），分阶段计时
+  collect_src_files、analyze_file（串行）、analyze_files（并行）、compute_commit_stats、BOM 写出，
+  报告吞吐（行/秒）与峰值 RSS
+
+## tree 场景参数
+- 规模：`--files` 文件数、`--lines` 平均行数（每个文件在 50%~150% 之间随机）
+- 扩展名：`--ext-mix ts=5,html=2,scss=1,js=1,css=1`（取值须在 SRC_EXTENSIONS 内）
+- 标记：`--marker-density` 含 AI 标记的文件比例，`--styles` 标记方式（path/header/block/standalone/inline）
+- diff：`--diff-files` head 提交修改的文件数、`--diff-lines` 每个文件追加的行数
+
+## 用法
+  python3 scripts/bench_aibom.py standalone
+  python3 scripts/bench_aibom.py standalone --sizes 50000 100000 200000
+  python3 scripts/bench_aibom.py regress
+  python3 scripts/bench_aibom.py tree
+  python3 scripts/bench_aibom.py tree --files 20000 --lines 300 --marker-density 0.5 --styles block inline
+  python3 scripts/bench_aibom.py tree --keep /tmp/aibom-bench   # 保留生成的仓库
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import process_aibom  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 最大规模与最小规模的单行耗时之比超过该值视为非线性
+LINEAR_TOLERANCE = 2.0
+# 合成树支持的标记方式
+MARKER_STYLES = ("path", "header", "block", "standalone", "inline")
+# 每个目录下的文件数
+FILES_PER_DIR = 25
+
+
+def gen_nested_standalone(n_lines: int, depth: int = 4) -> bytes:
+    """
+    生成约 n_lines 行的 TS 文件：顶层一个 standalone 标记覆盖全文件，
+    内部每层缩进都重复出现 `// @generated-ai`（嵌套 standalone），触发逐块重扫的最坏情况
+    """
+    out = ["// bench: nested standalone markers\n"] * (process_aibom.HEADER_LINES + 1)
+    out.append("// @generated-ai\n")
+    k = 0
+    while len(out) < n_lines:
+        out.append("export class Gen%d {\n" % k)
+        for level in range(1, depth + 1):
+            pad = "  " * level
+            out.append(pad + "// @generated-ai\n")
+            out.append(pad + "run%d_%d() {\n" % (k, level))
+        for level in range(depth, 0, -1):
+            pad = "  " * level
+            out.append(pad + "  // @generated-ai\n")
+            out.append(pad + "  const v%d = %d;\n" % (level, k))
+            out.append(pad + "}\n")
+        out.append("}\n")
+        out.append("\n")
+        k += 1
+    return "".join(out).encode("utf-8")
+
+
+def _time_analyze(path: str, data: bytes, repeat: int) -> tuple:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = process_aibom.analyze_content(path, data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_standalone(sizes: list, repeat: int) -> bool:
+    print("📈 [standalone] 嵌套 standalone 标记，analyze_content 耗时（取 %d 次最优）" % repeat)
+    per_line = []
+    for n in sizes:
+        data = gen_nested_standalone(n)
+        elapsed, r = _time_analyze("src/bench/nested.ts", data, repeat)
+        us = elapsed / r["total_lines"] * 1e6
+        per_line.append(us)
+        print("   %7d 行 | AI %7d 行 | %.3fs | %.2f µs/行" % (r["total_lines"], r["ai_lines"], elapsed, us))
+    ratio = per_line[-1] / per_line[0] if per_line[0] else 0
+    ok = ratio <= LINEAR_TOLERANCE
+    print("   单行耗时比（最大/最小规模）: %.2f %s" % (ratio, "✅ 线性" if ok else "❌ 超出 %.1f" % LINEAR_TOLERANCE))
+    return ok
+
+
+# ---- 正确性回归 ----
+
+def check_typechange_diff() -> bool:
+    """
+    一个提交内 src/a.ts 由普通文件变为符号链接（raw 状态 T，补丁为删除 + 新增两段），
+    随后新增 src/main.ts（2 行 AI）：main.ts 的新增行与明细不能错位到符号链接的补丁段
+    """
+    root = tempfile.mkdtemp(prefix="aibom-regress-")
+    try:
+        src = os.path.join(root, "src")
+        os.makedirs(src)
+        _git(root, "init", "-q")
+        with open(os.path.join(src, "a.ts"), "w") as f:
+            f.write("const a = 1;\n")
+        with open(os.path.join(src, "t.ts"), "w") as f:
+            f.write("export const t = 1;\n")
+        _git(root, "add", "-A")
+        _git(root, "commit", "-qm", "base")
+        os.remove(os.path.join(src, "a.ts"))
+        try:
+            os.symlink("t.ts", os.path.join(src, "a.ts"))
+        except (OSError, NotImplementedError):
+            print("   ⚠️ 无法创建符号链接，跳过类型变更检查")
+            return True
+        with open(os.path.join(src, "main.ts"), "w") as f:
+            f.write("const m = 1; // @ai-generated\nconst n = 2; // @ai-generated\n")
+        _git(root, "add", "-A")
+        _git(root, "commit", "-qm", "typechange")
+
+        files = process_aibom.collect_src_files(root)
+        results = process_aibom.analyze_files(files, root, jobs=1)
+        stats = process_aibom.compute_commit_stats("HEAD~1", "HEAD", root, results)
+        details = [(d["file"], d["line"], d["content"]) for d in stats["ai_line_details"]]
+        expected = [("src/main.ts", 1, "const m = 1; // @ai-generated"),
+                    ("src/main.ts", 2, "const n = 2; // @ai-generated")]
+        ok = stats["ai_lines"] == 2 and stats["total_added"] == 3 and details == expected
+        print("   类型变更后的文件: AI %s 行 / 新增 %s 行 %s" % (stats["ai_lines"], stats["total_added"],
+                                                     "✅" if ok else "❌ 明细 %s" % details))
+        return ok
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _write(root: str, rel: str, text: str):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def check_diff_edge_cases() -> bool:
+    """
+    批量 diff 解析的边界：带修改的重命名（取新路径、只计新增行）、二进制文件（只计变更文件）、
+    删除（计入变更文件、无新增行）、路径含空格 / 引号 / 非 ASCII 字符（-z 输出不转义）
+    """
+    root = tempfile.mkdtemp(prefix="aibom-regress-")
+    try:
+        _git(root, "init", "-q")
+        _write(root, "src/old name.ts", "".join("export const v%d = %d;\n" % (k, k) for k in range(20)))
+        with open(os.path.join(root, "src", "bin.ts"), "wb") as f:
+            f.write(b"\0\1\2binary\n")
+        _write(root, "src/del.ts", "const d = 1; // @ai-generated\n")
+        _git(root, "add", "-A")
+        _git(root, "commit", "-qm", "base")
+        _git(root, "mv", "src/old name.ts", "src/new name.ts")
+        with open(os.path.join(root, "src", "new name.ts"), "a", encoding="utf-8") as f:
+            f.write("export const w = 1; // @ai-generated\n")
+        with open(os.path.join(root, "src", "bin.ts"), "wb") as f:
+            f.write(b"\0\1\3binary2\n")
+        os.remove(os.path.join(root, "src", "del.ts"))
+        _write(root, 'src/q"uo te.ts', "const a = 1; // @ai-generated\nconst b = 2; // @ai-generated\nconst c = 3;\n")
+        _write(root, "src/中 文.ts", "const z = 1; // @ai-generated\n")
+        _git(root, "add", "-A")
+        _git(root, "commit", "-qm", "edge cases")
+
+        files = process_aibom.collect_src_files(root)
+        results = process_aibom.analyze_files(files, root, jobs=1)
+        stats = process_aibom.compute_commit_stats("HEAD~1", "HEAD", root, results)
+        details = [(d["file"], d["line"]) for d in stats["ai_line_details"]]
+        expected = [("src/new name.ts", 21), ('src/q"uo te.ts', 1), ('src/q"uo te.ts', 2), ("src/中 文.ts", 1)]
+        ok = (stats["changed_files"] == 5 and stats["total_added"] == 5 and stats["ai_lines"] == 4
+              and sorted(details) == sorted(expected))
+        print("   重命名 / 二进制 / 删除 / 特殊路径: 变更 %s 个文件，新增 %s 行，AI %s 行 %s"
+              % (stats["changed_files"], stats["total_added"], stats["ai_lines"],
+                 "✅" if ok else "❌ 明细 %s" % details))
+        return ok
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def check_whole_repo_root() -> bool:
+    """
+    roots 为 "."（以及 "./"、""）表示整个仓库：工作区扫描、非 git 目录遍历、--ref HEAD 与 --commit
+    使用同一判定，得到相同的文件集合
+    """
+    root = tempfile.mkdtemp(prefix="aibom-regress-")
+    try:
+        _git(root, "init", "-q")
+        _write(root, "app.ts", "const a = 1; // @ai-generated\n")
+        _write(root, "README.md", "# readme\n")
+        _git(root, "add", "-A")
+        _git(root, "commit", "-qm", "base")
+        _write(root, "lib/util.js", "export const u = 1; // @ai-generated\nexport const v = 2;\n")
+        _git(root, "add", "-A")
+        _git(root, "commit", "-qm", "add util")
+
+        ok = True
+        expected = ["app.ts", "lib/util.js"]
+        for roots in (["."], ["./"], [""]):
+            config = process_aibom.ScanConfig(roots)
+            worktree = process_aibom.collect_src_files(root, config)
+            scandir = sorted(process_aibom._scandir_src_files(root, config))
+            ref = [fp for fp, _ in process_aibom.list_ref_files("HEAD", root, config)]
+            results = process_aibom.analyze_files(worktree, root, jobs=1)
+            stats = process_aibom.compute_commit_stats("HEAD~1", "HEAD", root, results, config=config)
+            same = worktree == scandir == ref == expected
+            good = same and stats["changed_files"] == 1 and stats["ai_lines"] == 1
+            ok = ok and good
+            print("   roots=%s: 工作区 %s / 遍历 %s / --ref %s 个文件，--commit 变更 %s 个、AI %s 行 %s"
+                  % (json.dumps(roots), len(worktree), len(scandir), len(ref), stats["changed_files"],
+                     stats["ai_lines"], "✅" if good else "❌"))
+        return ok
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def check_comment_lexer() -> bool:
+    """
+    注释词法分析的行为约定（输入 → ai_ranges）：字符串、模板字符串、HTML/Vue 文本中的标记不计入；
+    HTML 注释、<script> 内注释照常识别；SCSS 独占一行的 /* @ai-generated */ 与 TS 的 // 一样按 standalone 处理
+    标记放在头部判定行之后，避免落入整文件规则
+    """
+    ts_pad = "".join("const p%d = %d;\n" % (k, k) for k in range(process_aibom.HEADER_LINES + 2))
+    html_pad = "".join("<p>line %d</p>\n" % k for k in range(process_aibom.HEADER_LINES + 2))
+    scss_pad = "".join(".c%d { color: red; }\n" % k for k in range(process_aibom.HEADER_LINES + 2))
+    n = process_aibom.HEADER_LINES + 2
+    cases = [
+        ("字符串中的标记", "src/a.ts", ts_pad + 'const s = "// @ai-generated";\nconst t = \'@ai-generated\';\n', []),
+        ("模板字符串中的标记", "src/a.ts", ts_pad + "const t = `\n// @ai-generated\n${x}`;\nconst u = 1;\n", []),
+        ("TS standalone 注释", "src/a.ts", ts_pad + "// @ai-generated\nfunction f() {\n  return 1;\n}\n\nconst z = 2;\n",
+         [(n + 1, n + 6)]),
+        ("HTML 文本中的标记", "src/a.html", html_pad + "<p>@ai-generated</p>\n<div></div>\n", []),
+        ("HTML 注释", "src/a.html", html_pad + "<!-- @ai-generated -->\n<div></div>\n", [(n + 1, n + 2)]),
+        ("Vue 模板文本 / <script> 注释", "src/a.vue",
+         html_pad + "<template><p>@ai-generated</p></template>\n<script>\n// @ai-generated\nconst a = 1;\n</script>\n",
+         [(n + 3, n + 5)]),
+        ("SCSS 块注释 standalone", "src/a.scss",
+         scss_pad + "/* @ai-generated */\n.a {\n  color: red;\n}\n\n.b { color: blue; }\n", [(n + 1, n + 6)]),
+        ("SCSS 行尾块注释", "src/a.scss", scss_pad + ".a { color: red; } /* @ai-generated */\n.b { color: blue; }\n",
+         [(n, n + 1)]),
+    ]
+    ok = True
+    for name, path, text, expected in cases:
+        got = process_aibom.analyze_content(path, text.encode("utf-8"))["ai_ranges"]
+        good = [tuple(r) for r in got] == expected
+        ok = ok and good
+        print("   %s: %s %s" % (name, got, "✅" if good else "❌ 期望 %s" % expected))
+    return ok
+
+
+def check_regex_literal_scan() -> bool:
+    """
+    长行中大量未闭合的正则字面量 / 字符类（"(/[" 重复）不能退化为二次方扫描；
+    正常的正则字面量（含 // 的字符类）仍按代码处理，其后的行尾注释照常识别
+    """
+    # 带标记才会走注释词法分析（无标记的文件被预筛跳过）
+    text = "const x = f" + "(/[" * 13400 + ";\nconst y = 1; // @ai-generated\n"
+    start = time.perf_counter()
+    long_ai = process_aibom.analyze_content("src/long.ts", text.encode("utf-8"))["ai_lines"]
+    elapsed = time.perf_counter() - start
+    data = b"const r = /[//]/g; // @ai-generated\nconst s = '// @ai-generated';\n"
+    r = process_aibom.analyze_content("src/re.ts", data)
+    ok = elapsed < 2 and long_ai == 1 and r["ai_lines"] == 1
+    print("   未闭合正则字面量长行: %.2fs, 正则字面量后注释 AI %s 行 %s"
+          % (elapsed, r["ai_lines"], "✅" if ok else "❌"))
+    return ok
+
+
+def run_regress() -> bool:
+    print("🧪 [regress] 正确性回归")
+    return all([check_typechange_diff(), check_diff_edge_cases(), check_whole_repo_root(), check_comment_lexer(),
+                check_regex_literal_scan()])
+
+
+# ---- 合成 src/ 树 ----
+
+def _comment(ext: str, text: str) -> str:
+    if ext in (".html", ".htm", ".vue"):
+        return "<!-- %s -->" % text
+    if ext == ".css":
+        return "/* %s */" % text
+    return "// %s" % text
+
+
+def _code_line(ext: str, k: int, indent: int) -> str:
+    pad = "  " * indent
+    if ext in (".html", ".htm", ".vue"):
+        return pad + '<div class="item-%d">{{ value%d }}</div>' % (k, k)
+    if ext in (".scss", ".css"):
+        return pad + "color: #%06x;" % (k * 2654435761 % 0xFFFFFF)
+    return pad + "const v%d = compute(%d, 'k%d');" % (k, k, k)
+
+
+def _open_block(ext: str, k: int, indent: int) -> str:
+    pad = "  " * indent
+    if ext in (".html", ".htm", ".vue"):
+        return pad + '<section id="s%d">' % k
+    if ext in (".scss", ".css"):
+        return pad + ".block-%d {" % k
+    return pad + "function f%d() {" % k
+
+
+def _close_block(ext: str, indent: int) -> str:
+    pad = "  " * indent
+    return pad + ("</section>" if ext in (".html", ".htm", ".vue") else "}")
+
+
+def gen_file(ext: str, n_lines: int, style, rng: random.Random, start: int = 0) -> list:
+    """
+    生成约 n_lines 行的源码：由若干缩进块组成，style 为 None 时不含标记；
+    header/block/standalone/inline 对应 process_aibom 的标注方式（path 由调用方体现在路径上）
+    """
+    out = []
+    if style == "header":
+        out.append(_comment(ext, "@ai-generated"))
+    k = start
+    while len(out) < n_lines:
+        size = rng.randint(3, 12)
+        marked = style in ("block", "standalone", "inline") and rng.random() < 0.3
+        if marked and style == "block":
+            out.append(_comment(ext, "@ai-generated-begin"))
+        if marked and style == "standalone":
+            out.append(_comment(ext, "@ai-generated"))
+        out.append(_open_block(ext, k, 0))
+        for i in range(size):
+            line = _code_line(ext, k + i, 1)
+            if marked and style == "inline" and i % 2 == 0:
+                line += " " + _comment(ext, "@ai-generated")
+            out.append(line)
+        out.append(_close_block(ext, 0))
+        if marked and style == "block":
+            out.append(_comment(ext, "@ai-generated-end"))
+        out.append("")
+        k += size
+    return [line + "\n" for line in out]
+
+
+def _parse_mix(spec: str) -> list:
+    """'ts=5,html=2' -> [('.ts', 5.0), ('.html', 2.0)], restricted to SRC_EXTENSIONS."""
+    mix = []
+    for part in spec.split(","):
+        ext, _, weight = part.strip().partition("=")
+        ext = "." + ext.lstrip(".").lower()
+        if ext not in process_aibom.SRC_EXTENSIONS:
+            raise SystemExit("❌ 不支持的扩展名 %s（可选: %s）" % (ext, " ".join(process_aibom.SRC_EXTENSIONS)))
+        mix.append((ext, float(weight or 1)))
+    return mix
+
+
+def _git(root: str, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@example.com",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@example.com")
+    subprocess.run(["git"] + list(args), cwd=root, env=env, check=True, capture_output=True)
+
+
+def gen_tree(root: str, files: int, lines: int, mix: list, density: float, styles: list,
+             diff_files: int, diff_lines: int, seed: int) -> dict:
+    """
+    在 root 下生成 src/ 与两个提交：base（全量文件）与 head（diff_files 个文件各追加 diff_lines 行）
+    返回生成统计 {files, lines, marked, base, head}
+    """
+    rng = random.Random(seed)
+    exts = [e for e, _ in mix]
+    weights = [w for _, w in mix]
+    paths = []
+    total = 0
+    marked = 0
+    for i in range(files):
+        ext = rng.choices(exts, weights)[0]
+        style = rng.choice(styles) if styles and rng.random() < density else None
+        group = i // FILES_PER_DIR
+        folder = "src/app/services" if group % 10 == 0 else "src/app/mod%04d" % group
+        if style == "path":
+            folder += "/ai-gen"
+        rel = "%s/file%05d%s" % (folder, i, ext)
+        body = gen_file(ext, rng.randint(max(1, lines // 2), max(1, lines * 3 // 2)), style, rng)
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+        with open(os.path.join(root, rel), "w", encoding="utf-8") as f:
+            f.writelines(body)
+        paths.append((rel, ext, style))
+        total += len(body)
+        marked += style is not None
+
+    _git(root, "init", "-q")
+    _git(root, "add", "-A")
+    _git(root, "commit", "-q", "-m", "bench: base")
+    for rel, ext, style in rng.sample(paths, min(diff_files, len(paths))):
+        if style in (None, "path", "header"):
+            style = rng.choice(styles) if styles and rng.random() < density else None
+        extra = gen_file(ext, diff_lines, style if style not in ("path", "header") else None, rng, start=10 ** 6)
+        with open(os.path.join(root, rel), "a", encoding="utf-8") as f:
+            f.writelines(extra)
+    _git(root, "add", "-A")
+    _git(root, "commit", "-q", "-m", "bench: head")
+    return {"files": files, "lines": total, "marked": marked, "base": "HEAD~1", "head": "HEAD"}
+
+
+# ---- 计时 ----
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process and its finished children (e.g. pool workers) in MB; 0 if unavailable."""
+    if resource is None:
+        return 0.0
+    unit = 1 if sys.platform == "darwin" else 1024  # ru_maxrss：macOS 为字节，Linux 为 KB
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, child_rss) * unit / (1024 * 1024)
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def _report(name: str, elapsed: float, units: int, unit: str):
+    rate = units / elapsed if elapsed > 0 else float("inf")
+    print("   %-26s %8.3fs | %12s %s/秒 | 峰值 RSS %7.1f MB" % (name, elapsed, "{:,.0f}".format(rate), unit, peak_rss_mb()))
+
+
+def bench_tree(args) -> bool:
+    styles = [s for s in args.styles if s]
+    root = args.keep or tempfile.mkdtemp(prefix="aibom-bench-")
+    if args.keep:
+        if os.path.exists(root) and os.listdir(root):
+            raise SystemExit("❌ --keep 目录非空: %s" % root)
+        os.makedirs(root, exist_ok=True)
+    try:
+        elapsed, info = _timed(lambda: gen_tree(
+            root, args.files, args.lines, _parse_mix(args.ext_mix), args.marker_density, styles,
+            args.diff_files, args.diff_lines, args.seed))
+        print("📈 [tree] %s 个文件 | %s 行 | 含标记 %s 个 | 生成耗时 %.1fs | %s"
+              % (info["files"], info["lines"], info["marked"], elapsed, root))
+
+        elapsed, files = _timed(lambda: process_aibom.collect_src_files(root))
+        _report("collect_src_files", elapsed, len(files), "文件")
+
+        def serial():
+            return {fp: process_aibom.analyze_file(fp, root) for fp in files}
+
+        elapsed, results = _timed(serial)
+        lines = sum(r["total_lines"] for r in results.values())
+        ai = sum(r["ai_lines"] for r in results.values())
+        _report("analyze_file (serial)", elapsed, lines, "行")
+
+        elapsed, parallel = _timed(lambda: process_aibom.analyze_files(files, root, args.jobs))
+        _report("analyze_files (-j %s)" % (args.jobs or os.cpu_count()), elapsed, lines, "行")
+        same = parallel == results
+
+        elapsed, stats = _timed(lambda: process_aibom.compute_commit_stats(info["base"], info["head"], root, results))
+        _report("compute_commit_stats", elapsed, stats["total_added"], "新增行")
+
+        bom = {"metadata": {"properties": []}, "components": [
+            {"type": "file", "name": fp, "properties": [
+                {"name": "ai:generated", "value": "true"},
+                {"name": "ai:scope", "value": r["scope"]},
+                {"name": "ai:lines", "value": str(r["ai_lines"])},
+            ]} for fp, r in results.items() if r["scope"] in ("whole", "partial")]}
+        out = os.path.join(root, "aibom-final.json")
+        elapsed, _ = _timed(lambda: process_aibom.write_bom(bom, out))
+        _report("write_bom", elapsed, len(bom["components"]), "组件")
+
+        print("   AI 行 %s / %s | 提交新增 %s 行，AI %s 行 | 串行/并行结果一致: %s"
+              % (ai, lines, stats["total_added"], stats["ai_lines"], "✅" if same else "❌"))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"files": len(files), "lines": lines, "ai_lines": ai,
+                           "commit": {k: stats[k] for k in ("ai_lines", "total_added", "changed_files")},
+                           "peak_rss_mb": round(peak_rss_mb(), 1)}, f, indent=2)
+        return same
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="process_aibom.py 性能基准")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+    p_sa = sub.add_parser("standalone", help="嵌套 standalone 标记的线性度回归")
+    p_sa.add_argument("--sizes", type=int, nargs="+", default=[25000, 50000, 100000], help="文件行数规模")
+    p_sa.add_argument("--repeat", type=int, default=3, help="每个规模重复次数（取最优）")
+    sub.add_parser("regress", help="正确性回归（diff 解析等）")
+    p_tree = sub.add_parser("tree", help="合成 src/ 树 + git 历史，分阶段计时")
+    p_tree.add_argument("--files", type=int, default=2000, help="文件数")
+    p_tree.add_argument("--lines", type=int, default=200, help="平均每个文件的行数")
+    p_tree.add_argument("--ext-mix", default="ts=5,html=2,scss=1,js=1,css=1", help="扩展名权重，如 ts=5,html=2")
+    p_tree.add_argument("--marker-density", type=float, default=0.2, help="含 AI 标记的文件比例（0~1）")
+    p_tree.add_argument("--styles", nargs="+", choices=MARKER_STYLES, default=list(MARKER_STYLES),
+                        help="参与随机的标记方式")
+    p_tree.add_argument("--diff-files", type=int, default=50, help="head 提交修改的文件数")
+    p_tree.add_argument("--diff-lines", type=int, default=40, help="每个修改文件追加的行数")
+    p_tree.add_argument("--jobs", "-j", type=int, default=None, help="analyze_files 并行进程数，默认 CPU 核数")
+    p_tree.add_argument("--seed", type=int, default=1, help="随机种子（相同参数生成相同的树）")
+    p_tree.add_argument("--keep", default=None, metavar="DIR", help="在 DIR 生成并保留仓库（须为空目录）")
+    p_tree.add_argument("--json", default=None, metavar="PATH", help="另将汇总写入 JSON 文件")
+    args = parser.parse_args()
+    if args.scenario == "standalone":
+        ok = bench_standalone(sorted(args.sizes), args.repeat)
+        sys.exit(0 if ok else 1)
+    if args.scenario == "regress":
+        sys.exit(0 if run_regress() else 1)
+    if args.scenario == "tree":
+        sys.exit(0 if bench_tree(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,14 @@ AIBOM 全量统计脚本：支持整文件 + 部分代码片段 + 当前提交
 ## 支持的标注方式
 
 1. **整文件 - 路径**: 路径含 `ai-gen` → 整个文件计为 AI
-2. **整文件 - 头部**: 前 10 行内任一行含 `@ai-generated` 或 `@generated-ai` → 整个文件
+2. **整文件 - 头部**: 前 10 行内任一纯注释行含 `@ai-generated` 或 `@generated-ai` → 整个文件
 3. **部分 - 块开始/结束**:
    - `// @ai-generated-begin` ... `// @ai-generated-end` 之间的行
 4. **部分 - 独立注释块**: `// @ai-generated` 单独一行 → 标记下一块（到缩进回退）
-5. **部分 - 行尾/行内**: 某行含 `@ai-generated` → 该行计为 AI
+5. **部分 - 行尾/行内**: 某行注释中含 `@ai-generated` → 该行计为 AI
+
+标记只在注释中生效：按扩展名族（TS/JS、HTML/Vue、SCSS/CSS）单遍词法扫描，
+跨行跟踪块注释、模板字符串与 HTML 注释，字符串字面量和 HTML 文本里的标记不计。
 
 ## 统计维度
 - **项目累计**: 扫描 src/ 全量，统计总 AI 渗透率
@@ -21,15 +24,44 @@ AIBOM 全量统计脚本：支持整文件 + 部分代码片段 + 当前提交
   python3 scripts/process_aibom.py              # 项目累计
   python3 scripts/process_aibom.py --commit     # 含当前提交统计（默认 base=HEAD~1）
   python3 scripts/process_aibom.py --commit --base origin/main
+  python3 scripts/process_aibom.py --ref v1.2.0 --commit   # 分析指定提交（不 checkout），diff 基准 v1.2.0~1
   python3 scripts/process_aibom.py --append-history
+  python3 scripts/process_aibom.py history -n 20          # 最近 20 条历史
+  python3 scripts/process_aibom.py history --since 2026-02 --format jsonl
+  python3 scripts/process_aibom.py backfill v1.0..HEAD --append-history   # 回填范围内每个提交的累计统计
+  python3 scripts/process_aibom.py --commit --summary-env "$GITHUB_ENV" --summary-md "$GITHUB_STEP_SUMMARY"
+  python3 scripts/process_aibom.py --commit --shard 2/4   # CI 矩阵分片，写出 aibom-shard-2-of-4.json
+  python3 scripts/process_aibom.py merge aibom-shard-*-of-4.json --append-history   # 合并为最终产物
+  python3 scripts/process_aibom.py watch --port 8765   # 常驻增量统计，GET /stats、/history
+  python3 scripts/process_aibom.py --attribution  # git blame AI 区间，按引入提交 / 作者汇总 AI 行
+  python3 scripts/process_aibom.py --jobs 8       # 8 个进程并行分析（默认 CPU 核数）
+  python3 scripts/process_aibom.py --no-cache     # 忽略 .aibom-cache/ 分析缓存
+  python3 scripts/process_aibom.py --metrics-out aibom-metrics.json   # 分阶段耗时、git 调用、最慢文件
+  python3 scripts/process_aibom.py --profile      # cProfile → aibom-profile.pstats
+
+也可在进程内使用：Scanner(".").scan() 返回 ScanResult（见 AI_STATS_TEST_SCENARIOS.md「进程内 API」）
 """
-import argparse
+import bisect
+import errno
+import fnmatch
+import hashlib
+import io
 import json
 import os
+import posixpath
 import re
-import subprocess
-from datetime import datetime
-from pathlib import Path
+import select
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from itertools import accumulate, islice
+from json.encoder import encode_basestring_ascii as _encode_str
 
 # 支持的文件类型
 SRC_EXTENSIONS = ('.ts', '.tsx', '.html', '.htm', '.scss', '.css', '.js', '.jsx', '.vue')
@@ -37,6 +69,44 @@ SRC_EXTENSIONS = ('.ts', '.tsx', '.html', '.htm', '.scss', '.css', '.js', '.jsx'
 HEADER_LINES = 10
 # AI 标记关键字（不区分大小写）
 AI_MARKERS = ('@ai-generated', '@ai-generated-begin', '@ai-generated-end', '@generated-ai')
+# AI 标记的正则源（覆盖 AI_MARKERS 全部关键字），文本与字节两种模式共用
+_MARKER_PATTERN = r"@(?:ai-generated|generated-ai)"
+# 预筛：原始字节中不区分大小写查找 AI 标记；未命中的文件只计数非空行，跳过逐行解析
+_MARKER_BYTES_RE = re.compile(_MARKER_PATTERN.encode("ascii"), re.IGNORECASE)
+# str.strip() 在 ASCII 范围内去除的空白（换行另行处理）
+_ASCII_BLANKS = b" \t\x0b\x0c\x1c\x1d\x1e\x1f"
+# 分析缓存：默认目录、最大条目数（超出按 LRU 淘汰）
+CACHE_DIR = ".aibom-cache"
+CACHE_MAX_ENTRIES = 50000
+# --attribution 控制台列出的作者 / 提交数
+ATTRIBUTION_CONSOLE_TOP = 10
+# 解析逻辑变更时递增，与 AI_MARKERS/HEADER_LINES 一起决定缓存版本
+ANALYZER_VERSION = 3
+# 历史记录：追加式 JSONL；旧版 JSON 数组文件首次使用时自动迁移
+HISTORY_FILE = "aibom-history.jsonl"
+LEGACY_HISTORY_FILE = "aibom-history.json"
+# 扫描配置文件（可选，位于项目根；结构见 ScanConfig）
+CONFIG_FILE = "aibom.config.json"
+# --profile 未指定路径时的 pstats 输出文件
+PROFILE_FILE = "aibom-profile.pstats"
+# --shard 部分结果：默认文件名（按 i、N 格式化）与格式标识，merge 时校验
+SHARD_FILE = "aibom-shard-%d-of-%d.json"
+SHARD_FORMAT = "aibom-shard/2"
+# 输入 SBOM（可不存在）与 AIBOM 输出
+BASE_SBOM_FILE = "base-sbom.json"
+BOM_FILE = "aibom-final.json"
+# 提交 AI 行明细：流式写出的 JSONL 文件；控制台与 Markdown 摘要最多展示的条数（完整明细见文件）
+DETAILS_FILE = "commit-ai-lines.jsonl"
+DETAILS_CONSOLE_MAX = 50
+DETAILS_SUMMARY_MAX = 200
+# watch 模式 HTTP 端点默认端口（仅监听 127.0.0.1）
+WATCH_PORT = 8765
+# 每批读入内存并分析的文件 / blob 数（缓存未命中的工作区文件、--ref、backfill），限制同时驻留的内容
+ANALYSIS_BATCH = 2000
+# 文件数低于该值时串行分析（进程池启动开销大于收益）
+PARALLEL_MIN_FILES = 64
+# 每个 worker 期望领取的批次数（批次越大 IPC 越少，越小负载越均衡）
+BATCHES_PER_WORKER = 4
 
 
 def _get_base_indent(line: str) -> int:
@@ -47,67 +117,187 @@ def _count_non_empty(lines: list[str]) -> int:
     return sum(1 for l in lines if l.strip())
 
 
-def _marker_in_comment(line: str, line_lower: str) -> bool:
-    """Return True if any AI marker on this line appears after a comment delimiter.
-    Prevents false positives when the marker appears in string literals or HTML text.
-    Supported delimiters: // /* <!-- #
-    """
-    line_lower_orig = line.lower()
-    for marker in ('@ai-generated', '@generated-ai'):
-        pos = line_lower_orig.find(marker)
-        if pos == -1:
-            continue
-        before = line[:pos]
-
-        # Exclude: marker inside string literal (odd number of quotes before = unclosed string)
-        # Simple heuristic: does not handle escaped quotes
-        n_single = before.count("'")
-        n_double = before.count('"')
-        if n_single % 2 == 1 or n_double % 2 == 1:
-            continue
-
-        # Exclude: marker in HTML element text content (between > and <)
-        if '>' in before and '<' in line[pos:]:
-            seg_before_gt = before.rpartition('>')[-1]
-            seg_after_lt = line[pos:].partition('<')[0]
-            if marker.lower() in (seg_before_gt + seg_after_lt).lower():
-                continue
-
-        if ('//' in before or '/*' in before or '<!--' in before or
-                before.lstrip().startswith('#') or before.lstrip().startswith('*')):
-            return True
-    return False
-
-
-def _marker_in_string_or_html(line: str, marker_substr: str = '@ai-generated') -> bool:
-    """Return True if marker on this line is inside a string literal or HTML text content."""
-    line_lower = line.lower()
-    pos = line_lower.find(marker_substr)
-    if pos == -1:
-        pos = line_lower.find('@generated-ai')
-        if pos == -1:
-            return False
-        marker_substr = '@generated-ai'
-    before = line[:pos]
+# ---- 行区间：AI 区域与 diff 新增行均以有序、不相交的半开区间 [start, end) 列表表示 ----
+# AI 区间可包含空行（整文件、块内空行），行数统计只计非空行；diff 侧只取非空新增行，求交即得 AI 新增行
 
-    if before.count("'") % 2 == 1 or before.count('"') % 2 == 1:
-        return True
-    if '>' in before and '<' in line[pos:]:
-        return True
-    return False
+def _add_range(ranges: list, start: int, end: int):
+    """Add [start, end) to a sorted, disjoint range list in place, merging overlapping/adjacent ranges.
+    Ascending input (the common case) is O(1); out-of-order input falls back to a merge.
+    """
+    if start >= end:
+        return
+    if not ranges or start > ranges[-1][1]:
+        ranges.append((start, end))
+        return
+    last_start, last_end = ranges[-1]
+    if start >= last_start:
+        if end > last_end:
+            ranges[-1] = (last_start, end)
+        return
+    lo = bisect.bisect_left([e for _, e in ranges], start)
+    hi = bisect.bisect_right(ranges, (end, float("inf")))
+    merged = (min(start, ranges[lo][0]), max(end, ranges[hi - 1][1])) if lo < hi else (start, end)
+    ranges[lo:hi] = [merged]
+
+
+def _add_index(ranges: list, i: int):
+    _add_range(ranges, i, i + 1)
+
+
+def _ranges_len(ranges: list) -> int:
+    return sum(end - start for start, end in ranges)
+
+
+def _iter_range_indices(ranges: list):
+    for start, end in ranges:
+        yield from range(start, end)
+
+
+def intersect_ranges(a: list, b: list) -> list:
+    """Intersection of two sorted, disjoint range lists (linear two-pointer merge)."""
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end:
+            out.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+# ---- 注释词法分析：按扩展名族对全文单遍正则扫描，跨行识别块注释/模板字符串/HTML 注释 ----
+# 每个模式交替匹配「注释」（命名组 c）与「代码段」（连续的代码、字符串、模板、正则字面量），
+# 字符串等内部的注释分隔符随代码段一起被吞掉，不会被误认为注释。模板字符串不区分 ${} 嵌套。
+
+# 字符串/模板均写成展开循环形式（[^q\\]*(?:\\.[^q\\]*)*），避免逐字符交替匹配
+_JS_STR = r"'[^'\\\n]*(?:\\.[^'\\\n]*)*'?|\"[^\"\\\n]*(?:\\.[^\"\\\n]*)*\"?"
+_JS_TEMPLATE = r"`[^`\\]*(?:\\[\s\S][^`\\]*)*`?"
+# 这些字符（其后至多一个空格/Tab）之后的 / 视为正则字面量开头，否则为除号
+_JS_REGEX_PRECEDERS = r"[(,=:\[!&|?{};]"
+# 正则字面量及其中 [...] 字符类的长度上限（字符单元数）：未闭合的 / 或 [ 每次尝试最多向后扫描这么远，
+# 避免长行中每个 / 都扫到行尾导致的二次方耗时；超长的按除号处理
+_JS_REGEX_MAX = 256
+_JS_REGEX = (r"(?:(?<=" + _JS_REGEX_PRECEDERS + r")|(?<=" + _JS_REGEX_PRECEDERS + r"[ \t]))"
+             r"/(?![/*])(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.){0,%d}\]){1,%d}/"
+             % (_JS_REGEX_MAX, _JS_REGEX_MAX))
+_SCRIPT_TOKENS = re.compile(
+    r"(?P<c>//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))"
+    r"|(?:[^/'\"`]+|" + _JS_STR + r"|" + _JS_TEMPLATE + r"|" + _JS_REGEX + r"|/(?![/*]))+"
+)
+# SCSS 的 // 仅在行首/空白/;{} 之后视为注释，避免 url(http://...) 误判
+_SCSS_TOKENS = re.compile(
+    r"(?P<c>/\*[\s\S]*?(?:\*/|\Z)|(?<![^\s;{}])//[^\n]*)"
+    r"|(?:[^/'\"]+|" + _JS_STR + r"|/(?![/*])|(?<=[^\s;{}])//)+"
+)
+_CSS_TOKENS = re.compile(
+    r"(?P<c>/\*[\s\S]*?(?:\*/|\Z))"
+    r"|(?:[^/'\"]+|" + _JS_STR + r"|/(?!\*))+"
+)
+# HTML/Vue：<!-- --> 注释；<script>/<style> 元素整体匹配，内容交给对应模式；其余标签与文本为代码
+_MARKUP_TOKENS = re.compile(
+    r"(?P<c><!--[\s\S]*?(?:-->|\Z))"
+    r"|(?P<embed><(?i:(?P<tag>script|style))\b[^>]*>)(?P<body>[\s\S]*?)(?:</(?i:script|style)\s*>|\Z)"
+    r"|(?:[^<]+|<(?!!--|(?i:script|style)\b)(?:[a-zA-Z/!?](?:\"[^\"]*\"|'[^']*'|[^'\">])*>?)?)+"
+)
+_MARKER_RE = re.compile(_MARKER_PATTERN, re.IGNORECASE)
+
+_TOKEN_PATTERNS = {
+    '.ts': _SCRIPT_TOKENS, '.tsx': _SCRIPT_TOKENS, '.js': _SCRIPT_TOKENS, '.jsx': _SCRIPT_TOKENS,
+    '.html': _MARKUP_TOKENS, '.htm': _MARKUP_TOKENS, '.vue': _MARKUP_TOKENS,
+    '.scss': _SCSS_TOKENS, '.css': _CSS_TOKENS,
+}
+
+
+def _comment_spans(pattern, text: str, pos: int = 0, endpos=None) -> list:
+    """All comment (start, end) spans in text[pos:endpos], in order; embedded script/style is recursed into."""
+    endpos = len(text) if endpos is None else endpos
+    if pattern is not _MARKUP_TOKENS:
+        return [m.span() for m in pattern.finditer(text, pos, endpos) if m.lastgroup == "c"]
+    spans = []
+    for m in pattern.finditer(text, pos, endpos):
+        if m.lastgroup == "c":
+            spans.append(m.span())
+        elif m.start("embed") != -1:
+            if m.group("tag").lower() == "script":
+                sub = _SCRIPT_TOKENS
+            else:
+                scss = any(lang in m.group("embed").lower() for lang in ("scss", "sass", "less"))
+                sub = _SCSS_TOKENS if scss else _CSS_TOKENS
+            spans.extend(_comment_spans(sub, text, m.start("body"), m.end("body")))
+    return spans
 
 
-def _is_header_marker_declaration(line: str, line_lower: str) -> bool:
-    """Return True if the marker on this line is an actual whole-file declaration,
+def _scan_markers(file_path: str, text: str, offsets: list) -> dict:
+    """
+    单遍扫描整个文件，返回 {行号: (该行注释文本小写, 该行是否含代码)}，仅包含注释中出现 AI 标记的行
+    字符串、模板、正则字面量、HTML 文本/属性中的标记不会出现在结果里；offsets 为各行起始偏移
+    """
+    pattern = _TOKEN_PATTERNS.get(os.path.splitext(file_path.lower())[1], _SCRIPT_TOKENS)
+    spans = _comment_spans(pattern, text)
+    if not spans:
+        return {}
+
+    pieces = {}
+    for cs, ce in spans:
+        for mm in _MARKER_RE.finditer(text, cs, ce):
+            ln = bisect.bisect_right(offsets, mm.start()) - 1
+            pieces.setdefault(ln, None)
+    if not pieces:
+        return {}
+
+    starts = [s for s, _ in spans]
+    marks = {}
+    for ln in pieces:
+        ls, le = offsets[ln], offsets[ln + 1]
+        # 与本行相交的全部注释片段（含不带标记的），剩余部分即代码
+        k = bisect.bisect_left(starts, le)
+        overlapping = []
+        while k > 0 and spans[k - 1][1] > ls:
+            k -= 1
+            overlapping.append((max(spans[k][0], ls), min(spans[k][1], le)))
+        overlapping.reverse()
+        comment = " ".join(text[s:e] for s, e in overlapping).lower()
+        code = []
+        prev = ls
+        for s, e in overlapping:
+            code.append(text[prev:s])
+            prev = e
+        code.append(text[prev:le])
+        marks[ln] = (comment, bool("".join(code).strip()))
+    return marks
+
+
+@lru_cache(maxsize=None)
+def _dedent_re(indent: int):
+    return re.compile(r"^[^\S\n]{0,%d}\S" % (indent - 1), re.MULTILINE)
+
+
+def _find_dedent(text: str, offsets: list, start: int, stop: int, indent: int) -> int:
+    """First non-blank line in [start, stop) indented less than `indent` (as _get_base_indent); stop if none."""
+    if indent <= 0 or start >= stop:
+        return stop
+    m = _dedent_re(indent).search(text, offsets[start], offsets[stop])
+    return bisect.bisect_right(offsets, m.start()) - 1 if m else stop
+
+
+def _has_block_marker(comment) -> bool:
+    return comment is not None and ('@ai-generated-begin' in comment or '@ai-generated-end' in comment)
+
+
+def _is_marker_declaration(comment: str) -> bool:
+    """Return True if the marker in this comment is an actual declaration,
     not descriptive text (e.g. JSDoc describing the marker format).
     E.g. ' * @ai-generated' -> True; ' * Single line with // @ai-generated at end' -> False.
     """
-    line_lower_orig = line.lower()
     for marker in ('@ai-generated', '@generated-ai'):
-        pos = line_lower_orig.find(marker)
+        pos = comment.find(marker)
         if pos == -1:
             continue
-        after = line[pos + len(marker):].strip().rstrip('*/').strip().lower()
+        after = comment[pos + len(marker):].strip().rstrip('*/').rstrip('->').strip()
         # Substantial prose after marker (e.g. "at end counts as ai") = descriptive, not declaration
         if len(after) > 8 and ' ' in after and any(c.isalpha() for c in after):
             return False
@@ -115,13 +305,8 @@ def _is_header_marker_declaration(line: str, line_lower: str) -> bool:
     return False
 
 
-def analyze_file(file_path: str, project_root: str = ".") -> dict:
-    """
-    分析单个文件，返回整文件/部分片段的 AI 统计
-    支持: 路径(ai-gen)、头部(@ai-generated)、行尾、块(@ai-generated-begin/end)
-    """
-    full_path = os.path.join(project_root, file_path)
-    result = {
+def _empty_result() -> dict:
+    return {
         "total_lines": 0,
         "whole_file": False,
         "partial_lines": 0,
@@ -129,214 +314,873 @@ def analyze_file(file_path: str, project_root: str = ".") -> dict:
         "scope": "none",
         "details": []
     }
+
+
+def _read_bytes(file_path: str, project_root: str = "."):
+    """Read raw file content; None if the file cannot be read."""
     try:
-        with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
+        with open(os.path.join(project_root, file_path), 'rb') as f:
+            return f.read()
     except Exception:
+        return None
+
+
+def _split_lines(data: bytes) -> list:
+    """Decode and split exactly like open(..., errors='ignore').readlines() (universal newlines)."""
+    return io.StringIO(data.decode('utf-8', errors='ignore'), newline=None).readlines()
+
+
+def analyze_file(file_path: str, project_root: str = ".") -> dict:
+    """
+    分析单个文件，返回整文件/部分片段的 AI 统计
+    支持: 路径(ai-gen)、头部(@ai-generated)、行尾、块(@ai-generated-begin/end)
+    """
+    data = _read_bytes(file_path, project_root)
+    if data is None:
+        return _empty_result()
+    return analyze_content(file_path, data)
+
+
+def _count_lines_ascii(data: bytes):
+    """(non-empty lines, lines) of pure-ASCII content without decoding or splitting into str lines.
+    Matches _count_non_empty(_split_lines(data)) exactly for ASCII input.
+    """
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    n_lines = data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+    # 删除行内空白后只剩换行，bytes.split() 的片段数即非空行数
+    return len(data.translate(None, _ASCII_BLANKS).split()), n_lines
+
+
+def _prefilter(data: bytes):
+    """
+    快速预筛：内容中不含任何 AI 标记时返回 (非空行数, 行数)，否则返回 None（需完整解析）
+    ASCII 内容直接在字节上做正则扫描与计数；非 ASCII 内容解码后整体 lower() 一次再查找
+    """
+    if data.isascii():
+        if _MARKER_BYTES_RE.search(data):
+            return None
+        return _count_lines_ascii(data)
+    text_lower = data.decode('utf-8', errors='ignore').lower()
+    if '@ai-generated' in text_lower or '@generated-ai' in text_lower:
+        return None
+    lines = _split_lines(data)
+    return _count_non_empty(lines), len(lines)
+
+
+def analyze_content(file_path: str, data: bytes) -> dict:
+    """对已读入内存的文件内容做 AI 统计；file_path 仅用于路径规则判定"""
+    result = _empty_result()
+    # AI 行区间；整文件为单个区间 [0, 行数)（含空行，计数以 ai_lines 为准，diff 侧只取非空新增行）
+    result["ai_ranges"] = []
+    by_path = 'ai-gen' in file_path.lower()
+
+    # 0. 无标记文件（绝大多数）：只计数，不做逐行解析
+    counts = _prefilter(data)
+    if counts is not None:
+        total, n_lines = counts
+        result["total_lines"] = total
+        if by_path and total:
+            result["whole_file"] = True
+            result["ai_lines"] = total
+            result["scope"] = "whole"
+            result["ai_ranges"] = [(0, n_lines)]
         return result
 
+    lines = _split_lines(data)
     total = _count_non_empty(lines)
     result["total_lines"] = total
-    result["ai_line_indices"] = set()
     if total == 0:
         return result
 
-    def _all_non_empty_indices():
-        return set(i for i, ln in enumerate(lines) if ln.strip())
-
     # 1. 整文件：路径含 ai-gen
-    if 'ai-gen' in file_path.lower():
+    if by_path:
         result["whole_file"] = True
         result["ai_lines"] = total
         result["scope"] = "whole"
-        result["ai_line_indices"] = _all_non_empty_indices()
+        result["ai_ranges"] = [(0, len(lines))]
         return result
 
-    # 2. 整文件：头部(前 N 行) 有 @ai-generated 或 @generated-ai（排除块标记、描述性文案、行尾注释）
-    for line in lines[:HEADER_LINES]:
-        sl = line.strip().lower()
-        if '@ai-generated' in sl or '@generated-ai' in sl:
-            if '@ai-generated-begin' not in sl and '@ai-generated-end' not in sl:
-                # 仅纯注释行上的声明触发整文件，排除：1)描述性文字 2)代码+行尾注释（归 inline 处理）
-                is_comment_line = (
-                    sl.startswith('//') or sl.startswith('#') or
-                    sl.startswith('*') or sl.startswith('<!--') or sl.startswith('/*')
-                )
-                if is_comment_line and _is_header_marker_declaration(line, sl):
-                    result["whole_file"] = True
-                    result["ai_lines"] = total
-                    result["scope"] = "whole"
-                    result["ai_line_indices"] = _all_non_empty_indices()
-                    return result
-
-    # 3. 部分片段：行级 + 块级标记
-    ai_line_indices = set()
+    # 注释中带标记的行：全文一次扫描，后续各规则只访问这些行，块内普通行按区间批量处理
+    text = "".join(lines)
+    offsets = [0]
+    offsets.extend(accumulate(map(len, lines)))
+    marks = _scan_markers(file_path, text, offsets)
+    mark_lines = sorted(marks)
+
+    # 2. 整文件：头部(前 N 行) 纯注释行上有 @ai-generated 或 @generated-ai 声明
+    #    （排除块标记、描述性文案；代码+行尾注释归 inline 处理）
+    for ln in mark_lines:
+        if ln >= HEADER_LINES:
+            break
+        comment, has_code = marks[ln]
+        if has_code or _has_block_marker(comment):
+            continue
+        if _is_marker_declaration(comment):
+            result["whole_file"] = True
+            result["ai_lines"] = total
+            result["scope"] = "whole"
+            result["ai_ranges"] = [(0, len(lines))]
+            return result
+
+    # 3. 部分片段：行级 + 块级标记（标记须位于注释中，字符串/HTML 文本中的标记不计）
+    # standalone 块在遇到含 @ai-generated 的注释行时结束
+    stop_lines = [ln for ln in mark_lines if '@ai-generated' in marks[ln][0]]
+    ai_ranges = []
     in_block = False
     block_indent = -1
+    pending = 0  # 尚未按块规则处理的首行
+    consumed = 0  # standalone 块已覆盖到的行（不含），其中的标记行无需再处理
 
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        stripped = line.strip()
-        s_lower = stripped.lower()
-        indent = _get_base_indent(line)
-
-        if not stripped:
-            i += 1
+    for ln in mark_lines:
+        if ln < consumed:
+            # standalone 块内只可能有 @generated-ai 标记（@ai-generated 会截断块），
+            # 它们的嵌套块/行内行都落在已覆盖区间内，跳过即可，保证整体线性
             continue
+        if in_block:
+            # 上一标记行与本行之间的普通行：直到缩进回退（严格小于 begin 行）都在块内，回退行本身不计
+            dedent = _find_dedent(text, offsets, pending, ln, block_indent)
+            _add_range(ai_ranges, pending, dedent)
+            if dedent < ln:
+                in_block = False
+        pending = ln + 1
+        comment, has_code = marks[ln]
+        indent = _get_base_indent(lines[ln])
 
-        # 块结束（排除字符串/HTML 中的标记）
-        if '@ai-generated-end' in s_lower and not _marker_in_string_or_html(line, '@ai-generated-end'):
+        # 块结束
+        if '@ai-generated-end' in comment:
             in_block = False
             block_indent = -1
-            i += 1
             continue
 
-        # 块开始（排除字符串/HTML 中的标记）
-        if '@ai-generated-begin' in s_lower and not _marker_in_string_or_html(line, '@ai-generated-begin'):
+        # 块开始
+        if '@ai-generated-begin' in comment:
             in_block = True
             block_indent = indent
-            i += 1
             continue
 
         if in_block:
-            # 缩进回退（严格小于 begin 行）时退出块
             if indent < block_indent and block_indent >= 0:
                 in_block = False
             else:
-                ai_line_indices.add(i)
-            i += 1
+                _add_index(ai_ranges, ln)
             continue
 
         # 纯注释行上的 standalone 标记：标记「下一块」到缩进回退（排除描述性文案）
-        is_comment = (
-            s_lower.startswith('//') or s_lower.startswith('#') or
-            s_lower.startswith('*') or s_lower.startswith('<!--')
-        )
-        if is_comment and ('@ai-generated' in s_lower or '@generated-ai' in s_lower):
-            if '@ai-generated-end' in s_lower or '@ai-generated-begin' in s_lower:
-                i += 1
+        if not has_code:
+            if not _is_marker_declaration(comment):
                 continue
-            if not _is_header_marker_declaration(line, s_lower):
-                i += 1
-                continue
-            # 标记下一块：从下一非空行起，直到缩进严格小于注释行
-            j = i + 1
-            while j < len(lines):
-                nl = lines[j]
-                ns = nl.strip()
-                ni = _get_base_indent(lines[j])
-                if not ns:
-                    j += 1
-                    continue
-                if ni < indent:
-                    break
-                if '@ai-generated' in ns.lower() or '@ai-generated-begin' in ns.lower():
-                    break
-                ai_line_indices.add(j)
-                j += 1
-            i += 1
+            # 标记下一块：从下一非空行起，直到缩进严格小于注释行或下一个 @ai-generated 注释行
+            k = bisect.bisect_right(stop_lines, ln)
+            stop = stop_lines[k] if k < len(stop_lines) else len(lines)
+            consumed = _find_dedent(text, offsets, ln + 1, stop, indent)
+            _add_range(ai_ranges, ln + 1, consumed)
             continue
 
-        # 行尾/行内标记：标记必须出现在注释部分（// /* <!-- # 之后），避免字符串/文本内容误报
-        if ('@ai-generated' in s_lower or '@generated-ai' in s_lower):
-            if '@ai-generated-begin' not in s_lower and '@ai-generated-end' not in s_lower:
-                if _marker_in_comment(line, s_lower):
-                    ai_line_indices.add(i)
+        # 行尾/行内标记：代码行的注释部分含标记
+        _add_index(ai_ranges, ln)
 
-        i += 1
+    if in_block:
+        _add_range(ai_ranges, pending, _find_dedent(text, offsets, pending, len(lines), block_indent))
 
-    result["partial_lines"] = len(ai_line_indices)
-    result["ai_lines"] = len(ai_line_indices)
-    result["ai_line_indices"] = ai_line_indices
+    ai_count = sum(_count_non_empty(lines[start:end]) for start, end in ai_ranges)
+    result["partial_lines"] = ai_count
+    result["ai_lines"] = ai_count
+    result["ai_ranges"] = ai_ranges
     if result["ai_lines"] > 0:
         result["scope"] = "partial"
     return result
 
 
+def git_blob_sha(data: bytes) -> str:
+    """Object id git assigns to this content (`git hash-object`)."""
+    h = hashlib.sha1(b"blob %d\0" % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+def _rules_stamp() -> str:
+    """Version stamp of the marker rules; any change invalidates cached analysis."""
+    rules = [ANALYZER_VERSION, list(AI_MARKERS), HEADER_LINES, list(SRC_EXTENSIONS)]
+    return hashlib.sha1(json.dumps(rules).encode("utf-8")).hexdigest()[:12]
+
+
+class AnalysisCache:
+    """
+    按内容哈希（git blob SHA）缓存 analyze_file 结果（scope、total_lines、AI 行区间），持久化到 cache_dir
+    - 路径规则（ai-gen）与扩展名参与 key，同内容不同规则不会串用
+    - 文件名带规则版本戳，AI_MARKERS / HEADER_LINES 变化后旧缓存自动作废
+    - 超过 max_entries 时按最近使用顺序（LRU）淘汰；只有新增条目时才重写缓存文件，全部命中不落盘
+    """
+
+    PREFIX = "analysis-"
+
+    def __init__(self, cache_dir: str, max_entries: int = CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.path = os.path.join(cache_dir, "%s%s.json" % (self.PREFIX, _rules_stamp()))
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    @staticmethod
+    def key(file_path: str, blob_sha: str) -> str:
+        lower = file_path.lower()
+        kind = ("p" if 'ai-gen' in lower else "") + os.path.splitext(lower)[1]
+        return "%s:%s" % (blob_sha, kind)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except Exception:
+            self.entries = {}
+        return self
+
+    def get(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        # 重新插入到末尾，dict 顺序即 LRU 顺序；命中只调整内存中的顺序，不触发落盘
+        self.entries[key] = entry
+        self.hits += 1
+        scope, total, ai_lines, ranges = entry
+        result = _empty_result()
+        result["total_lines"] = total
+        result["ai_lines"] = ai_lines
+        result["ai_ranges"] = [tuple(r) for r in ranges]
+        result["scope"] = scope
+        if scope == "whole":
+            result["whole_file"] = True
+        elif scope == "partial":
+            result["partial_lines"] = ai_lines
+        return result
+
+    def put(self, key: str, result: dict):
+        if "ai_ranges" not in result:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = [result["scope"], result["total_lines"], result["ai_lines"], result["ai_ranges"]]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        overflow = len(self.entries) - self.max_entries
+        if overflow > 0:
+            for key in list(self.entries)[:overflow]:
+                del self.entries[key]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        # 清理其他规则版本的缓存文件
+        for name in os.listdir(self.cache_dir):
+            full = os.path.join(self.cache_dir, name)
+            if name.startswith(self.PREFIX) and full != self.path:
+                try:
+                    os.remove(full)
+                except OSError:
+                    pass
+        self.dirty = False
+
+
+def _analyze_path(file_path: str, project_root: str = "."):
+    """Worker entry for uncached runs: reads and analyzes one file; unreadable files give an empty result."""
+    return _analyze_blob((file_path, _read_bytes(file_path, project_root)))
+
+
+def analyze_files(file_paths: list, project_root: str = ".", jobs=None, cache=None, timings=None,
+                  mp_context: str = None) -> dict:
+    """
+    批量分析文件，返回 {file_path: analyze_file 结果}，顺序与 file_paths 一致
+    jobs > 1 且文件数足够时使用进程池，按批次派发以降低 IPC 开销；结果与串行完全一致
+    cache 为 AnalysisCache 时，内容未变的文件直接复用缓存结果，只分析变更文件；
+    未命中文件的内容已为计算哈希读入，每满 ANALYSIS_BATCH 个直接交给 worker 分析，不再重复读盘，
+    内存中同时驻留的内容不超过一批
+    timings 为 dict 时记录每个实际分析文件的耗时 {file_path: 秒}（缓存命中的不计）
+    mp_context 为进程池启动方式，有其他线程在运行时（如 watch 的 HTTP 服务）应传 "spawn"，避免 fork 后死锁
+    """
+    if cache is None:
+        seconds = None if timings is None else []
+        analyzed = _map_analysis(partial(_analyze_path, project_root=project_root), file_paths, jobs, seconds,
+                                 mp_context)
+        if timings is not None:
+            timings.update(zip(file_paths, seconds))
+        return dict(zip(file_paths, analyzed))
+
+    results = {}
+
+    def misses():
+        """Yield (path, data, blob SHA) of cache misses; hits go straight into results."""
+        for fp in file_paths:
+            data = _read_bytes(fp, project_root)
+            sha = git_blob_sha(data) if data is not None else None
+            hit = cache.get(cache.key(fp, sha)) if sha is not None else None
+            if hit is not None:
+                results[fp] = hit
+            else:
+                yield fp, data, sha
+
+    for batch in _batched(misses(), ANALYSIS_BATCH):
+        seconds = None if timings is None else []
+        analyzed = _map_analysis(_analyze_blob, [(fp, data) for fp, data, _ in batch], jobs, seconds, mp_context)
+        if timings is not None:
+            timings.update(zip([fp for fp, _, _ in batch], seconds))
+        for (fp, _, sha), r in zip(batch, analyzed):
+            results[fp] = r
+            if sha is not None:
+                cache.put(cache.key(fp, sha), r)
+    return {fp: results[fp] for fp in file_paths}
+
+
+def _analyze_blob(item):
+    """Worker entry for in-memory content: (file_path, data) -> result; data None means a missing blob."""
+    file_path, data = item
+    if data is None:
+        return _empty_result()
+    return analyze_content(file_path, data)
+
+
+def analyze_ref_files(ref_files: list, blobs, jobs=None, cache=None, timings=None) -> dict:
+    """
+    分析 ref 中的文件（list_ref_files 的 [(路径, blob SHA)]），返回 {file_path: 结果}，顺序不变
+    ls-tree 已给出 blob SHA，缓存命中的文件无需读取内容；其余经 blobs（GitBlobReader）按 ANALYSIS_BATCH 分批
+    流式取出后在内存中分析，同时驻留的内容不超过一批
+    """
+    results = {}
+    pending = []
+    for fp, sha in ref_files:
+        hit = cache.get(cache.key(fp, sha)) if cache is not None else None
+        if hit is not None:
+            results[fp] = hit
+        else:
+            pending.append((fp, sha))
+
+    for batch in _batched(pending, ANALYSIS_BATCH):
+        items = list(zip([fp for fp, _ in batch], blobs.read_many([sha for _, sha in batch])))
+        seconds = None if timings is None else []
+        analyzed = _map_analysis(_analyze_blob, items, jobs, seconds)
+        if timings is not None:
+            timings.update(zip([fp for fp, _ in batch], seconds))
+        for (fp, sha), (_, data), r in zip(batch, items, analyzed):
+            results[fp] = r
+            if cache is not None and data is not None:
+                cache.put(cache.key(fp, sha), r)
+    return {fp: results[fp] for fp, _ in ref_files}
+
+
+def _batched(items, size: int):
+    """Yield lists of up to size consecutive items from any iterable."""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _timed_call(func, item):
+    """Run func(item) and return (result, seconds); picklable for process pools."""
+    start = time.perf_counter()
+    result = func(item)
+    return result, time.perf_counter() - start
+
+
+def _map_analysis(func, items: list, jobs=None, timings=None, mp_context: str = None) -> list:
+    """
+    对 items 逐个执行 func，结果顺序与 items 一致
+    jobs > 1 且数量足够时使用进程池，按批次派发以降低 IPC 开销；mp_context 为进程启动方式（如 "spawn"），默认平台缺省
+    timings 为列表时，按 items 顺序追加每项在 worker 内的耗时（秒）
+    """
+    call = func if timings is None else partial(_timed_call, func)
+    results = None
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(items) >= PARALLEL_MIN_FILES:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(items) // (jobs * BATCHES_PER_WORKER))
+        ctx = multiprocessing.get_context(mp_context) if mp_context else None
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+                results = list(pool.map(call, items, chunksize=chunksize))
+        except (OSError, NotImplementedError):
+            # 无法创建进程池（如受限沙箱缺少 /dev/shm）时退回串行
+            results = None
+    if results is None:
+        results = [call(item) for item in items]
+    if timings is None:
+        return results
+    timings.extend(seconds for _, seconds in results)
+    return [r for r, _ in results]
+
+
+class _GitCallStats:
+    """Process-wide count and wall time of git subprocesses; Metrics phases record the deltas."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+
+    @contextmanager
+    def track(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(time.perf_counter() - start)
+
+
+GIT_STATS = _GitCallStats()
+
+
 def _run_git(cmd, cwd="."):
+    import subprocess
     try:
-        r = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=30)
+        with GIT_STATS.track():
+            r = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=30)
         return r.stdout.strip() if r.returncode == 0 else ""
     except Exception:
         return ""
 
 
-def get_changed_src_files(base, head, project_root):
-    """获取 base..head 之间变更的 src/ 下源文件路径"""
-    out = _run_git(["git", "diff", "--name-only", base, head], cwd=project_root)
-    if not out:
+def _is_src_path(path: str, src_dir: str = "src") -> bool:
+    """True if path has a supported extension and lies under src_dir ("" is the whole repo)."""
+    prefix = src_dir.rstrip("/")
+    return (not prefix or path.startswith(prefix + "/")) and path.lower().endswith(SRC_EXTENSIONS)
+
+
+def _globs_re(patterns):
+    """One compiled regex matching any of the fnmatch patterns; None for an empty list."""
+    if not patterns:
+        return None
+    return re.compile("|".join("(?:%s)" % fnmatch.translate(p) for p in patterns))
+
+
+def shard_of(path: str, count: int) -> int:
+    """Stable 1-based shard of a project-relative path: CRC32 of its bytes, independent of PYTHONHASHSEED."""
+    return zlib.crc32(os.fsencode(path)) % count + 1
+
+
+class ScanConfig:
+    """
+    扫描配置（JSON，默认读取项目根的 aibom.config.json，不存在时使用默认值）
+    - roots: 扫描根目录（相对项目根），默认 ["src"]；"."、"./"、"" 表示整个仓库
+    - include / exclude: 相对项目根的 glob（fnmatch，* 可跨目录）；include 为空表示不限，始终只取 SRC_EXTENSIONS
+    - rollups: [{"name": 名称, "prefix": 目录}]，每项输出 stats:<name>:* 属性；
+      默认 services → src/app/services/，与之前的固定子目录统计一致
+    """
+
+    DEFAULT_ROLLUPS = [{"name": "services", "prefix": "src/app/services/"}]
+
+    def __init__(self, roots=None, include=None, exclude=None, rollups=None):
+        self.roots = [self._root(r) for r in (roots or ["src"])]
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.rollups = [(r["name"], r["prefix"].rstrip("/") + "/")
+                        for r in (self.DEFAULT_ROLLUPS if rollups is None else rollups)]
+        self._include_re = _globs_re(self.include)
+        self._exclude_re = _globs_re(self.exclude)
+        # (i, N)：只保留 shard_of(path, N) == i 的文件；由 --shard 设置，不来自配置文件
+        self.shard = None
+
+    @staticmethod
+    def _root(root: str) -> str:
+        """Normalise a root to a prefix without slashes; the whole repo becomes "" (matches every path)."""
+        root = posixpath.normpath(root or ".").strip("/")
+        return "" if root == "." else root
+
+    @property
+    def pathspecs(self) -> list:
+        """Git pathspecs for the roots ("." for the whole repo)."""
+        return [root or "." for root in self.roots]
+
+    @classmethod
+    def load(cls, path: str, required: bool = False) -> "ScanConfig":
+        """
+        Read a config file; a missing optional file yields the defaults.
+        Raises FileNotFoundError for a missing required file and ValueError for an invalid one.
+        """
+        if not os.path.exists(path):
+            if required:
+                raise FileNotFoundError("配置文件不存在: %s" % path)
+            return cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            unknown = set(data) - {"roots", "include", "exclude", "rollups"}
+            if unknown:
+                raise ValueError("未知字段 %s" % ", ".join(sorted(unknown)))
+            return cls(data.get("roots"), data.get("include"), data.get("exclude"), data.get("rollups"))
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            raise ValueError("配置文件无效: %s (%s)" % (path, e)) from e
+
+    def matches(self, path: str) -> bool:
+        """True if a project-relative path is a scanned source file."""
+        return any(_is_src_path(path, root) for root in self.roots) and self.selects(path)
+
+    def selects(self, path: str) -> bool:
+        """Apply only the include/exclude globs (for paths already known to be under a root)."""
+        if self._include_re is not None and not self._include_re.match(path):
+            return False
+        if self._exclude_re is not None and self._exclude_re.match(path):
+            return False
+        return self.shard is None or shard_of(path, self.shard[1]) == self.shard[0]
+
+    def to_dict(self) -> dict:
+        return {"roots": self.roots, "include": self.include, "exclude": self.exclude,
+                "rollups": [{"name": name, "prefix": prefix} for name, prefix in self.rollups]}
+
+
+class DirectoryTotals:
+    """
+    目录前缀表：每个文件把行数累加到它的所有祖先目录（"a/"、"a/b/" ...），
+    一次遍历后任意目录层级的汇总都是 O(1) 查表，rollup 数量不影响开销
+    """
+
+    def __init__(self):
+        self.dirs = {}
+
+    def add(self, path: str, total_lines: int, ai_lines: int, files: int = 1):
+        """Add a file's lines to all its ancestor directories; negative values remove it again."""
+        end = path.find("/")
+        while end != -1:
+            key = path[:end + 1]
+            node = self.dirs.get(key)
+            if node is None:
+                node = self.dirs[key] = [0, 0, 0]
+            node[0] += files
+            node[1] += total_lines
+            node[2] += ai_lines
+            if node[0] == 0:
+                del self.dirs[key]
+            end = path.find("/", end + 1)
+
+    def get(self, prefix: str) -> tuple:
+        """(files, total_lines, ai_lines) under a directory prefix ending with '/'."""
+        return tuple(self.dirs.get(prefix, (0, 0, 0)))
+
+
+class ProjectTotals:
+    """
+    项目累计统计，可按文件增量维护：add() 加入一个文件的贡献，remove() 减去，目录汇总同步增减
+    process() 全量累加一次；watch 模式对变更文件先减旧结果再加新结果，无需重新汇总全部文件
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.total_lines = 0
+        self.ai_whole_lines = 0
+        self.ai_partial_lines = 0
+        self.whole_files_count = 0
+        self.partial_files_count = 0
+        self.dirs = DirectoryTotals()
+
+    def add(self, path: str, r: dict, sign: int = 1):
+        self.files += sign
+        self.total_lines += sign * r["total_lines"]
+        self.dirs.add(path, sign * r["total_lines"], sign * r["ai_lines"], sign)
+        if r["scope"] == "whole":
+            self.ai_whole_lines += sign * r["ai_lines"]
+            self.whole_files_count += sign
+        elif r["scope"] == "partial":
+            self.ai_partial_lines += sign * r["partial_lines"]
+            self.partial_files_count += sign
+
+    def remove(self, path: str, r: dict):
+        self.add(path, r, -1)
+
+    @property
+    def ai_total_lines(self) -> int:
+        return self.ai_whole_lines + self.ai_partial_lines
+
+    @property
+    def ai_percentage(self):
+        return round((self.ai_total_lines / self.total_lines * 100), 2) if self.total_lines > 0 else 0
+
+    def rollups(self, config: ScanConfig) -> list:
+        """[(name, prefix, files, total_lines, ai_lines, ai_percentage)] for the configured rollups."""
+        out = []
+        for name, prefix in config.rollups:
+            files_count, r_total, r_ai = self.dirs.get(prefix)
+            r_pct = round((r_ai / r_total * 100), 2) if r_total > 0 else 0
+            out.append((name, prefix, files_count, r_total, r_ai, r_pct))
+        return out
+
+
+def resolve_commit(rev: str, project_root: str = ".") -> str:
+    """Full SHA of the commit rev points to; empty string if it cannot be resolved."""
+    return _run_git(["git", "rev-parse", "--verify", "--quiet", rev + "^{commit}"], project_root)
+
+
+def list_ref_files(ref: str, project_root: str = ".", config: ScanConfig = None) -> list:
+    """
+    列出 ref 中扫描范围内（config，默认 src/）所有支持的源文件，返回按路径排序的 [(路径, blob SHA)]，
+    与 collect_src_files 顺序一致；仅取普通文件（跳过符号链接与子模块），路径按文件系统编码解码，与 os.walk 结果一致
+    """
+    import subprocess
+    config = config or ScanConfig()
+    try:
+        with GIT_STATS.track():
+            raw = subprocess.run(["git", "ls-tree", "-r", "-z", "--full-tree", ref, "--"] + config.pathspecs,
+                                 cwd=project_root, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
         return []
-    result = []
-    for line in out.splitlines():
-        p = line.strip()
-        if p and p.startswith("src/") and any(p.lower().endswith(ext) for ext in SRC_EXTENSIONS):
-            result.append(p.replace("\\", "/"))
-    return sorted(set(result))
-
-
-def get_diff_added_line_numbers(base, head, filepath, project_root):
-    """解析 git diff，返回 filepath 在 head 版本中「新增行」的 0-based 行号集合"""
-    out = _run_git(["git", "diff", "-U0", base, head, "--", filepath], cwd=project_root)
-    if not out:
-        return set()
-    added = set()
-    hunk_re = re.compile(r"^@@ -[\d,]+ \+(\d+)(?:,(\d+))? @@")
-    new_line = 0
+    files = []
+    for rec in raw.split(b"\0"):
+        if not rec:
+            continue
+        meta, _, path = rec.partition(b"\t")
+        mode, kind, sha = meta.split(b" ")
+        if kind != b"blob" or mode == b"120000":
+            continue
+        fp = os.fsdecode(path)
+        if config.matches(fp):
+            files.append((fp, sha.decode("ascii")))
+    files.sort()
+    return files
+
+
+class GitBlobReader:
+    """
+    通过单个常驻 `git cat-file --batch` 进程读取 blob 内容（首次使用时启动）
+    read_many 由后台线程持续写入请求、主线程按序读取，整个文件列表只需一次进程往返
+    """
+
+    def __init__(self, project_root: str = "."):
+        self.project_root = project_root
+        self.proc = None
+        self.started = 0.0
+
+    def _start(self):
+        if self.proc is None:
+            import subprocess
+            self.started = time.perf_counter()
+            self.proc = subprocess.Popen(["git", "cat-file", "--batch"], cwd=self.project_root,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self.proc
+
+    def _read_one(self):
+        out = self.proc.stdout
+        header = out.readline()
+        if not header:
+            raise OSError("git cat-file exited unexpectedly")
+        parts = header.split()
+        if len(parts) != 3:
+            # "<sha> missing" / "<sha> ambiguous"
+            return None
+        data = out.read(int(parts[2]))
+        out.read(1)  # 内容后的换行
+        return data if parts[1] == b"blob" else None
+
+    def read(self, sha: str):
+        """Content of one blob; None if it does not exist."""
+        proc = self._start()
+        proc.stdin.write(sha.encode("ascii") + b"\n")
+        proc.stdin.flush()
+        return self._read_one()
+
+    def read_many(self, shas: list):
+        """Yield the content of each blob in order (None for missing ones)."""
+        if not shas:
+            return
+        proc = self._start()
+
+        def feed():
+            try:
+                proc.stdin.write(b"".join(sha.encode("ascii") + b"\n" for sha in shas))
+                proc.stdin.flush()
+            except (OSError, ValueError):
+                pass
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        for _ in shas:
+            yield self._read_one()
+        writer.join()
+
+    def reader_for(self, ref_files: list):
+        """A read_file(path) -> bytes | None callable over the given [(path, blob SHA)]."""
+        shas = dict(ref_files)
+        return lambda fp: self.read(shas[fp]) if fp in shas else None
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc.stdout.close()
+            self.proc = None
+            GIT_STATS.add(time.perf_counter() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _parse_raw_records(raw: bytes) -> list:
+    """Parse `git diff --raw -z` records into [(status, src_path, dst_path), ...]."""
+    entries = []
+    tokens = iter(raw.split(b"\0"))
+    for meta in tokens:
+        if not meta.startswith(b":"):
+            continue
+        status = meta.split()[-1].decode("ascii", "replace")
+        src = os.fsdecode(next(tokens, b""))
+        dst = os.fsdecode(next(tokens, b"")) if status[:1] in ("R", "C") else src
+        entries.append((status[:1], src, dst))
+    return entries
+
+
+def get_diff_added_lines(base, head, project_root, config: ScanConfig = None, ai_ranges: dict = None):
+    """
+    单次 `git diff --raw -p -z -U0 -M` 流式解析 base..head 的全部变更
+    返回 (changed_files, {file: (新增行数, head 版本中「非空」新增行的 0-based 区间列表, {行号: 明细片段})})
+    - raw 段（-z，NUL 分隔）给出每个文件对的状态与精确路径，不受空格/引号转义影响
+    - patch 段按 `diff --git` 顺序归属到 raw 记录，无需解析补丁头里的路径；
+      类型变更（T，如文件 ↔ 符号链接）输出「删除 + 新增」两段，对应同一条记录
+    - 重命名取新路径、删除取旧路径；二进制文件无 hunk，只计入变更文件
+    - ai_ranges 为 {file: AI 行区间} 时，落在其中的新增行顺带从补丁里截取明细片段，无需再读文件
+    """
+    import subprocess
+    config = config or ScanConfig()
+    cmd = ["git", "diff", "--raw", "-p", "-z", "-U0", "-M", "--no-color", "--no-ext-diff",
+           base, head, "--"] + config.pathspecs
+    started = time.perf_counter()
+    try:
+        proc = subprocess.Popen(cmd, cwd=project_root, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+    except Exception:
+        return [], {}
+
+    stream = proc.stdout
+    # raw 段内无换行（路径含换行除外），以首个空记录 "\0\0" 作为 raw/patch 分界
+    head_buf = b""
+    while b"\0\0" not in head_buf:
+        chunk = stream.readline()
+        if not chunk:
+            break
+        head_buf += chunk
+    raw, _, rest = head_buf.partition(b"\0\0")
+    entries = _parse_raw_records(raw)
+    sections = [e for e in entries for _ in range(2 if e[0] == "T" else 1)]
+
+    def _patch_lines():
+        if rest:
+            yield from rest.splitlines(keepends=True)
+        yield from stream
+
+    hunk_re = re.compile(rb"^@@ -[\d,]+ \+(\d+)(?:,(\d+))? @@")
+    ai_ranges = ai_ranges or {}
+    added_by_file = {}
+    target = None
+    # 当前文件的 AI 区间与游标：hunk 内新行号单调递增，游标只前进
+    file_ai = ()
+    k = 0
+    index = -1
     in_hunk = False
-    for raw in out.splitlines():
-        if raw.startswith("@@"):
-            m = hunk_re.match(raw)
+    new_line = 0
+    for raw_line in _patch_lines():
+        if raw_line.startswith(b"diff --git "):
+            index += 1
+            target = None
+            in_hunk = False
+            if index < len(sections):
+                status, src, dst = sections[index]
+                path = dst.replace("\\", "/")
+                if status != "D" and config.matches(path):
+                    target = added_by_file.setdefault(path, [0, [], {}])
+                    file_ai = ai_ranges.get(path, ())
+                    k = 0
+            continue
+        if target is None:
+            continue
+        if raw_line.startswith(b"@@"):
+            m = hunk_re.match(raw_line)
             if m:
                 new_line = int(m.group(1)) - 1
                 in_hunk = True
             continue
         if not in_hunk:
+            # 补丁头（---/+++/index/mode 等），首个 @@ 之前
             continue
-        if raw.startswith("+"):
-            if raw.startswith("+++"):
-                continue
-            added.add(new_line)
+        if raw_line.startswith(b"+"):
+            target[0] += 1
+            # 空行永远不是 AI 行，不进入区间，便于与整文件区间直接求交
+            text = raw_line[1:].decode("utf-8", "ignore")
+            if text.strip():
+                _add_index(target[1], new_line)
+                while k < len(file_ai) and file_ai[k][1] <= new_line:
+                    k += 1
+                if k < len(file_ai) and file_ai[k][0] <= new_line:
+                    target[2][new_line] = _detail_snippet(text)
             new_line += 1
-        elif not raw.startswith("---"):
-            new_line += 1
-    return added
+        # "-" 删除行与 "\ No newline" 不占新文件行号；-U0 下无上下文行
+    proc.wait()
+    GIT_STATS.add(time.perf_counter() - started)
+    if proc.returncode != 0:
+        return [], {}
+
+    changed = set()
+    for status, src, dst in entries:
+        path = (src if status == "D" else dst).replace("\\", "/")
+        if config.matches(path):
+            changed.add(path)
+    return sorted(changed), {fp: tuple(v) for fp, v in added_by_file.items()}
+
 
+def _detail_snippet(line: str) -> str:
+    """AI line detail content: the line without trailing whitespace, cut at 80 characters."""
+    content = line.rstrip()
+    return content[:80] + "..." if len(content) > 80 else content
 
-def compute_commit_stats(base, head, project_root, file_results):
-    """计算当前提交的 AI 统计：仅统计 diff 新增行中属于 AI 区域的行"""
-    changed = get_changed_src_files(base, head, project_root)
+
+def compute_commit_stats(base, head, project_root, file_results, read_file=None, config: ScanConfig = None,
+                         on_detail=None):
+    """
+    计算当前提交的 AI 统计：仅统计 diff 新增行中属于 AI 区域的行
+    - AI 行明细的内容直接取自 diff 流中的新增行，只保留 AI 区间内的片段；
+      仅当文件不在 file_results 中时才用 read_file(path) -> bytes | None 读取 head 侧内容（默认读工作区）
+    - on_detail 为可调用对象时逐条交给它（如 DetailWriter 流式写出），返回的 ai_line_details 为空；否则收集为列表
+    """
+    if read_file is None:
+        read_file = partial(_read_bytes, project_root=project_root)
+    ai_ranges = {fp: r["ai_ranges"] for fp, r in file_results.items() if r.get("ai_ranges")}
+    changed, added_by_file = get_diff_added_lines(base, head, project_root, config, ai_ranges)
     if not changed:
         return {"ai_lines": 0, "total_added": 0, "changed_files": 0, "ai_changed_files": 0, "ai_line_details": []}
     commit_ai = 0
     commit_total = 0
     ai_file_count = 0
     ai_line_details = []
+    emit = on_detail or ai_line_details.append
     for fp in changed:
-        added = get_diff_added_line_numbers(base, head, fp, project_root)
-        if not added:
+        total_added, added_ranges, snippets = added_by_file.get(fp, (0, [], {}))
+        if not total_added:
             continue
-        commit_total += len(added)
+        commit_total += total_added
         r = file_results.get(fp)
         if not r:
-            r = analyze_file(fp, project_root)
-        overlap = added & r.get("ai_line_indices", set())
+            data = read_file(fp)
+            r = _analyze_blob((fp, data))
+            file_lines = _split_lines(data) if data is not None else []
+            snippets = {i: _detail_snippet(line) for i, line in enumerate(file_lines)}
+        overlap = intersect_ranges(added_ranges, r.get("ai_ranges", []))
         if overlap:
-            commit_ai += len(overlap)
+            commit_ai += _ranges_len(overlap)
             ai_file_count += 1
-            full_path = os.path.join(project_root, fp)
-            try:
-                with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    file_lines = f.readlines()
-                for idx in sorted(overlap):
-                    if 0 <= idx < len(file_lines):
-                        content = file_lines[idx].rstrip()[:80]
-                        if len(file_lines[idx].rstrip()) > 80:
-                            content += '...'
-                        ai_line_details.append({"file": fp, "line": idx + 1, "content": content})
-            except Exception:
-                for idx in sorted(overlap):
-                    ai_line_details.append({"file": fp, "line": idx + 1, "content": ""})
+            for idx in _iter_range_indices(overlap):
+                emit({"file": fp, "line": idx + 1, "content": snippets.get(idx, "")})
     return {
         "ai_lines": commit_ai,
         "total_added": commit_total,
@@ -346,93 +1190,1018 @@ def compute_commit_stats(base, head, project_root, file_results):
     }
 
 
-def collect_src_files(project_root: str, src_dir: str = "src") -> list:
-    """递归收集 src 下所有支持的源文件"""
-    base = os.path.join(project_root, src_dir)
-    if not os.path.isdir(base):
+# ---- AI 行归属：git blame 只跑 AI 区间，按引入提交 / 作者汇总 ----
+
+UNCOMMITTED_SHA = "0" * 40
+
+
+def _parse_blame_incremental(out: str) -> tuple:
+    """
+    解析 `git blame --porcelain --incremental` 输出
+    返回 ({commit SHA: [[start, end), ...]}（0 起始行号）, {commit SHA: {author, author-mail, ...}}）
+    提交的头信息只在该提交首次出现时给出，filename 行结束一个片段
+    """
+    ranges = {}
+    meta = {}
+    sha = None
+    for line in out.splitlines():
+        if sha is None:
+            parts = line.split(" ")
+            if len(parts) != 4:
+                continue
+            sha, _, final, count = parts
+            _add_range(ranges.setdefault(sha, []), int(final) - 1, int(final) - 1 + int(count))
+            meta.setdefault(sha, {})
+        elif line.startswith("filename "):
+            sha = None
+        else:
+            key, _, value = line.partition(" ")
+            meta[sha].setdefault(key, value)
+    return ranges, meta
+
+
+def blame_ai_lines(file_path: str, data: bytes, ai_ranges: list, rev: str = None, project_root: str = ".") -> list:
+    """
+    对单个文件的 AI 区间执行一次 git blame（每个区间一个 -L），返回
+    [[commit SHA, 作者, 邮箱, author-time, summary, AI 行数], ...]，按 SHA 排序
+    只计非空行，与 ai_lines 口径一致；rev 为 None 时 blame 工作区内容，未提交的行归到 UNCOMMITTED_SHA
+    """
+    import subprocess
+    lines = _split_lines(data)
+    counted = []
+    for i in _iter_range_indices(ai_ranges):
+        if i < len(lines) and lines[i].strip():
+            _add_index(counted, i)
+    if not counted:
         return []
-    files = []
-    for root, _, names in os.walk(base):
-        for name in names:
-            if name.lower().endswith(SRC_EXTENSIONS):
-                full = os.path.join(root, name)
-                rel = os.path.relpath(full, project_root)
-                files.append(rel.replace("\\", "/"))
+    cmd = ["git", "blame", "--porcelain", "--incremental"]
+    for start, end in intersect_ranges(ai_ranges, [(0, len(lines))]):
+        cmd += ["-L", "%d,%d" % (start + 1, end)]
+    if rev:
+        cmd.append(rev)
+    cmd += ["--", file_path]
+    try:
+        with GIT_STATS.track():
+            r = subprocess.run(cmd, cwd=project_root, capture_output=True)
+        out = r.stdout.decode("utf-8", errors="replace") if r.returncode == 0 else ""
+    except OSError:
+        out = ""
+    ranges, meta = _parse_blame_incremental(out)
+    if not ranges:
+        # 未纳入版本库的文件：全部视为未提交
+        ranges = {UNCOMMITTED_SHA: counted}
+        meta = {UNCOMMITTED_SHA: {"author": "Not Committed Yet", "author-mail": "<not.committed.yet>"}}
+    entries = []
+    for sha in sorted(ranges):
+        n = _ranges_len(intersect_ranges(ranges[sha], counted))
+        if n:
+            m = meta[sha]
+            entries.append([sha, m.get("author", ""), m.get("author-mail", "").strip("<>"),
+                            int(m.get("author-time") or 0), m.get("summary", ""), n])
+    return entries
+
+
+class BlameCache(AnalysisCache):
+    """
+    按 (blob SHA, 路径) 缓存 blame_ai_lines 的结果，内容未变的文件不再重复 blame
+    文件名同样带规则版本戳（AI 区间随规则变化）；含未提交行的结果不缓存
+    """
+
+    PREFIX = "blame-"
+
+    @staticmethod
+    def key(file_path: str, blob_sha: str) -> str:
+        return "%s:%s" % (blob_sha, file_path)
+
+    def get(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entries: list):
+        if any(e[0] == UNCOMMITTED_SHA for e in entries):
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = entries
+        self.dirty = True
+
+
+class Attribution:
+    """AI 行按引入提交汇总（blame_ai_lines 的条目可直接累加，分片结果同样适用），并可按作者汇总"""
+
+    def __init__(self):
+        # {commit SHA: [作者, 邮箱, author-time, summary, AI 行数]}
+        self.commits = {}
+        self.files = 0
+        self.cached = 0
+
+    def add(self, entries: list, files: int = 1, cached: int = 0):
+        for sha, author, email, author_time, summary, n in entries:
+            c = self.commits.get(sha)
+            if c is None:
+                self.commits[sha] = [author, email, author_time, summary, n]
+            else:
+                c[4] += n
+        self.files += files
+        self.cached += cached
+
+    def to_dict(self) -> dict:
+        return {"files": self.files, "cached": self.cached,
+                "commits": [[sha] + c for sha, c in sorted(self.commits.items())]}
+
+    def update(self, data: dict):
+        """Add a to_dict() result (e.g. from a shard)."""
+        self.add(data["commits"], data["files"], data["cached"])
+
+    @property
+    def ai_lines(self) -> int:
+        return sum(c[4] for c in self.commits.values())
+
+    def by_commit(self) -> list:
+        """[(SHA, 作者, 邮箱, author-time, summary, AI 行数)]，AI 行数降序"""
+        return sorted(((sha,) + tuple(c) for sha, c in self.commits.items()), key=lambda c: (-c[5], c[0]))
+
+    def by_author(self) -> list:
+        """[(作者, 邮箱, AI 行数, 提交数)]，按邮箱（无邮箱时按姓名）归并，AI 行数降序"""
+        authors = {}
+        for sha, author, email, _, _, n in self.by_commit():
+            a = authors.setdefault(email or author, [author, email, 0, 0])
+            a[2] += n
+            a[3] += 1
+        return sorted((tuple(a) for a in authors.values()), key=lambda a: (-a[2], a[1], a[0]))
+
+    def properties(self) -> list:
+        """AIBOM metadata 属性：汇总数 + 每个作者、每个提交的 AI 行数"""
+        authors = self.by_author()
+        props = [
+            {"name": "stats:attribution:ai_lines", "value": str(self.ai_lines)},
+            {"name": "stats:attribution:files", "value": str(self.files)},
+            {"name": "stats:attribution:commits", "value": str(len(self.commits))},
+            {"name": "stats:attribution:authors", "value": str(len(authors))},
+        ]
+        for author, email, n, _ in authors:
+            name = "%s <%s>" % (author, email) if email else author
+            props.append({"name": "stats:attribution:author:%s" % name, "value": str(n)})
+        for sha, _, _, _, _, n in self.by_commit():
+            props.append({"name": "stats:attribution:commit:%s" % sha, "value": str(n)})
+        return props
+
+
+def attribute_ai_lines(file_results: dict, read_file, project_root: str = ".", rev: str = None, jobs=None,
+                       cache: BlameCache = None) -> Attribution:
+    """
+    对所有含 AI 区间的文件执行 blame_ai_lines（线程池并行，每个文件一个 git 子进程），汇总为 Attribution
+    read_file(path) -> bytes | None 读取与 AI 区间对应的内容（工作区或 --ref 的 blob）
+    """
+    attribution = Attribution()
+    pending = []
+    for fp, r in file_results.items():
+        if not r.get("ai_ranges"):
+            continue
+        data = read_file(fp)
+        if data is None:
+            continue
+        key = cache.key(fp, git_blob_sha(data)) if cache is not None else None
+        hit = cache.get(key) if cache is not None else None
+        if hit is not None:
+            attribution.add(hit, cached=1)
+        else:
+            pending.append((fp, data, r["ai_ranges"], key))
+
+    def run(item):
+        fp, data, ranges, _ = item
+        return blame_ai_lines(fp, data, ranges, rev, project_root)
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        for (_, _, _, key), entries in zip(pending, pool.map(run, pending)):
+            attribution.add(entries)
+            if cache is not None:
+                cache.put(key, entries)
+    return attribution
+
+
+def _print_attribution(attribution: Attribution):
+    authors = attribution.by_author()
+    print("📊 [AI 归属] git blame:")
+    print("   AI 行数: %s | 文件: %s（缓存命中 %s）| 引入提交: %s 个 | 作者: %s 人"
+          % (attribution.ai_lines, attribution.files, attribution.cached, len(attribution.commits), len(authors)))
+    for author, email, n, commits in authors[:ATTRIBUTION_CONSOLE_TOP]:
+        print("   %s <%s> | AI 行数: %s | 提交: %s" % (author, email, n, commits))
+    for sha, author, _, _, summary, n in attribution.by_commit()[:ATTRIBUTION_CONSOLE_TOP]:
+        print("   %s %s | AI 行数: %s | %s" % (sha[:8], author, n, summary[:60]))
+
+
+class _SubstringIndex:
+    """Aho–Corasick automaton over a set of keys: one pass over a text finds every key it contains."""
+
+    def __init__(self, keys):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for key in keys:
+            node = 0
+            for ch in key:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] = self.out[node] + (key,)
+        # BFS 建立失配指针，并把失配链上的输出合并到当前节点
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text: str) -> set:
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class BomPathIndex:
+    """
+    AI 文件路径 → BOM 组件匹配索引，语义与逐一比较
+    `fp in cname or cname.endswith(fp) or normpath(fp) in normpath(cname)` 完全一致，
+    但每个组件名只扫描一次（Aho–Corasick），复杂度 O(组件名总长 + 命中数)，与文件数无关
+    """
+
+    def __init__(self, file_paths):
+        self.raw = _SubstringIndex(file_paths)
+        self.norm_to_files = {}
+        for fp in file_paths:
+            self.norm_to_files.setdefault(os.path.normpath(fp), []).append(fp)
+        same = all(norm == fps[0] and len(fps) == 1 for norm, fps in self.norm_to_files.items())
+        self.norm = None if same else _SubstringIndex(self.norm_to_files)
+
+    def files_in(self, cname: str) -> set:
+        """All indexed file paths that match a component name."""
+        hit = self.raw.search(cname)
+        ncname = os.path.normpath(cname) if cname else cname
+        if self.norm is None:
+            if ncname != cname:
+                hit |= self.raw.search(ncname)
+        else:
+            for norm in self.norm.search(ncname):
+                hit.update(self.norm_to_files[norm])
+        return hit
+
+
+def _git_ls_src_files(project_root: str, config: ScanConfig):
+    """
+    通过 git 索引列出扫描范围内的文件：已跟踪 + 未被忽略的未跟踪文件，去掉工作区中已删除的
+    单次 `git ls-files -z -t`，不遍历目录；不在 git 仓库中或 git 不可用时返回 None
+    """
+    import subprocess
+    cmd = ["git", "--literal-pathspecs", "ls-files", "-z", "-t", "--cached", "--deleted", "--others",
+           "--exclude-standard", "--"] + config.pathspecs
+    try:
+        with GIT_STATS.track():
+            r = subprocess.run(cmd, cwd=project_root, capture_output=True)
+    except OSError:
+        return None
+    if r.returncode != 0:
+        return None
+    present = set()
+    deleted = set()
+    for rec in r.stdout.split(b"\0"):
+        if not rec:
+            continue
+        tag, path = rec[:1], os.fsdecode(rec[2:])
+        # 与 --commit / --ref 共用同一判定
+        if not config.matches(path):
+            continue
+        # H 已跟踪 / ? 未跟踪 / R 工作区已删除；其余标记（如 S skip-worktree）不在工作区
+        if tag == b"R":
+            deleted.add(path)
+        elif tag in (b"H", b"?", b"C"):
+            present.add(path)
+    return present - deleted
+
+
+def _ignore_re(pattern: str):
+    """Translate one .gitignore pattern (without !/trailing slash) into a regex on paths relative to its base."""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            out.append("/.*")
+            i += 3
+        elif c == "*":
+            out.append(".*" if pattern.startswith("**", i) else "[^/]*")
+            i += 2 if pattern.startswith("**", i) else 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j == -1:
+                out.append("\\[")
+                i += 1
+            else:
+                body = pattern[i + 1:j]
+                out.append("[" + ("^" + body[1:] if body[:1] == "!" else body).replace("\\", "\\\\") + "]")
+                i = j + 1
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return re.compile(("^" if anchored else "^(?:.*/)?") + "".join(out) + "$")
+
+
+class _IgnoreRules:
+    """
+    os.scandir 遍历用的 .gitignore 规则（不可变，进入子目录时叠加该目录的 .gitignore）
+    支持注释、! 取反、结尾 / 仅匹配目录、含 / 的锚定模式、**；后出现的规则优先
+    """
+
+    def __init__(self, rules=()):
+        self.rules = tuple(rules)
+
+    def extend(self, project_root: str, base: str, filename: str = ".gitignore") -> "_IgnoreRules":
+        """Rules plus those in <base>/<filename> (base is project-relative, '' or ending with '/')."""
+        try:
+            with open(os.path.join(project_root, base, filename), "r", encoding="utf-8", errors="ignore") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        added = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if line:
+                added.append((base, _ignore_re(line), negate, dir_only))
+        return _IgnoreRules(self.rules + tuple(added)) if added else self
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        if not self.rules:
+            return False
+        result = False
+        for base, regex, negate, dir_only in self.rules:
+            if (dir_only and not is_dir) or not path.startswith(base):
+                continue
+            if regex.match(path[len(base):]):
+                result = not negate
+        return result
+
+
+def _prunes_dir(exclude_globs: list, dir_path: str) -> bool:
+    """An exclude glob ending in '*' that matches 'dir/' also matches everything below it."""
+    return any(g.endswith("*") and fnmatch.fnmatchcase(dir_path + "/", g) for g in exclude_globs)
+
+
+def _scandir_src_files(project_root: str, config: ScanConfig) -> set:
+    """
+    非 git 环境的后备遍历：os.scandir 逐层展开，忽略的目录（.gitignore / .git/info/exclude、
+    以 * 结尾且覆盖整个目录的 exclude glob、.git）在进入前剪掉，只对普通文件检查扩展名
+    """
+    files = set()
+    base_rules = _IgnoreRules().extend(project_root, "", os.path.join(".git", "info", "exclude"))
+    base_rules = base_rules.extend(project_root, "")
+    for src_dir in config.roots:
+        # 根目录本身及其上级目录也需套用忽略规则，并叠加沿途的 .gitignore
+        rules = base_rules
+        rel = ""
+        skipped = False
+        for part in src_dir.split("/") if src_dir else ():
+            rel += part
+            if rules.ignored(rel, True) or _prunes_dir(config.exclude, rel):
+                skipped = True
+                break
+            rel += "/"
+            rules = rules.extend(project_root, rel)
+        if skipped or not os.path.isdir(os.path.join(project_root, src_dir)):
+            continue
+        stack = [(rel, rules)]
+        while stack:
+            rel_dir, rules = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(project_root, rel_dir)))
+            except OSError:
+                continue
+            for entry in entries:
+                rel = rel_dir + entry.name
+                if entry.is_dir():
+                    if entry.name == ".git" or rules.ignored(rel, True) or _prunes_dir(config.exclude, rel):
+                        continue
+                    sub = rel + "/"
+                    stack.append((sub, rules.extend(project_root, sub)))
+                elif config.matches(rel) and not rules.ignored(rel, False):
+                    files.add(rel)
+    return files
+
+
+def collect_src_files(project_root: str, config: ScanConfig = None) -> list:
+    """
+    收集扫描根（config，默认 src/）下所有支持的源文件，按 include/exclude 过滤，路径排序
+    - 优先读 git 索引（git ls-files）：不遍历目录，.gitignore 忽略的构建产物不计入
+    - 非 git 仓库或 git 不可用时退回 os.scandir 遍历，同样遵守 .gitignore 并提前剪掉忽略的目录
+    """
+    config = config or ScanConfig()
+    files = _git_ls_src_files(project_root, config)
+    if files is None:
+        files = _scandir_src_files(project_root, config)
     return sorted(files)
 
 
-def process(args=None):
-    input_path = "base-sbom.json"
-    output_path = "aibom-final.json"
-    project_root = "."
-    opts = args or argparse.Namespace(commit=False, base="HEAD~1", append_history=False)
+def _cpu_seconds() -> float:
+    """CPU time of this process plus reaped children (pool workers, git)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
 
-    # 1. 直接扫描 src/ 获取全量文件（不依赖 BOM）
-    src_files = collect_src_files(project_root)
-    file_results = {}
-    total_lines = 0
-    ai_whole_lines = 0
-    ai_partial_lines = 0
-    whole_files_count = 0
-    partial_files_count = 0
-
-    for fp in src_files:
-        r = analyze_file(fp, project_root)
-        file_results[fp] = r
-        total_lines += r["total_lines"]
-        if r["scope"] == "whole":
-            ai_whole_lines += r["ai_lines"]
-            whole_files_count += 1
-        elif r["scope"] == "partial":
-            ai_partial_lines += r["partial_lines"]
-            partial_files_count += 1
 
-    ai_total_lines = ai_whole_lines + ai_partial_lines
+class Metrics:
+    """
+    分阶段计量（--profile / --metrics-out）：每个阶段的墙钟与 CPU 时间（含已回收的子进程）、
+    文件/行数、git 子进程次数与耗时；另记录实际分析耗时最长的 N 个文件
+    阶段首尾相接：begin() 下一个阶段即结束上一个
+    """
+
+    def __init__(self, slowest: int = 10):
+        self.slowest = slowest
+        self.phases = []
+        self.file_times = {}
+        self.current = None
+        self.wall_start = time.perf_counter()
+        self.cpu_start = _cpu_seconds()
+        self.git_start = (GIT_STATS.calls, GIT_STATS.seconds)
+
+    def begin(self, name: str):
+        self.end()
+        self.current = {"name": name, "wall_s": time.perf_counter(), "cpu_s": _cpu_seconds(),
+                        "git_calls": GIT_STATS.calls, "git_s": GIT_STATS.seconds}
+
+    def count(self, **counts):
+        """Attach counts (files, lines, ...) to the current phase."""
+        if self.current is not None:
+            self.current.update(counts)
+
+    def end(self):
+        rec = self.current
+        if rec is None:
+            return
+        self.current = None
+        rec["wall_s"] = round(time.perf_counter() - rec["wall_s"], 6)
+        rec["cpu_s"] = round(_cpu_seconds() - rec["cpu_s"], 6)
+        rec["git_calls"] = GIT_STATS.calls - rec["git_calls"]
+        rec["git_s"] = round(GIT_STATS.seconds - rec["git_s"], 6)
+        self.phases.append(rec)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.wall_start
+
+    def slowest_files(self, file_results: dict) -> list:
+        top = sorted(self.file_times.items(), key=lambda kv: kv[1], reverse=True)[:self.slowest]
+        return [{"file": fp, "seconds": round(sec, 6), "lines": file_results.get(fp, {}).get("total_lines", 0)}
+                for fp, sec in top]
+
+    def to_dict(self, file_results: dict, **summary) -> dict:
+        self.end()
+        out = {"timestamp": _utc_iso()}
+        out.update(summary)
+        out.update({
+            "wall_s": round(self.elapsed(), 6),
+            "cpu_s": round(_cpu_seconds() - self.cpu_start, 6),
+            "git": {"calls": GIT_STATS.calls - self.git_start[0],
+                    "seconds": round(GIT_STATS.seconds - self.git_start[1], 6)},
+            "phases": self.phases,
+            "slowest_files": self.slowest_files(file_results),
+        })
+        return out
+
+    def print_summary(self, file_results: dict):
+        self.end()
+        print("⏱️ 分阶段耗时（总计 %.3fs）:" % self.elapsed())
+        for rec in self.phases:
+            extra = " ".join("%s=%s" % (k, v) for k, v in rec.items()
+                             if k not in ("name", "wall_s", "cpu_s", "git_calls", "git_s"))
+            print("   %-14s 墙钟 %8.3fs | CPU %8.3fs | git %3d 次 %7.3fs %s"
+                  % (rec["name"], rec["wall_s"], rec["cpu_s"], rec["git_calls"], rec["git_s"], extra))
+        slow = self.slowest_files(file_results)
+        if slow:
+            print("   最慢文件（前 %d）:" % len(slow))
+            for item in slow:
+                print("   %8.4fs %7s 行  %s" % (item["seconds"], item["lines"], item["file"]))
+
+
+class DetailWriter:
+    """
+    提交 AI 行明细的流式写出（JSONL，每行一个 {"file", "line", "content"}）：逐条写入，不在内存中累积
+    - limit 限制写入文件的条数（None 不限），超出部分只计数；统计数字不受影响
+    - 只保留前 keep 条供控制台与 Markdown 摘要展示
+    """
 
-    # 1a. src/app/services 子目录统计
-    SERVICES_PREFIX = "src/app/services/"
-    services_files = [fp for fp in src_files if fp.startswith(SERVICES_PREFIX)]
-    services_total = sum(file_results[fp]["total_lines"] for fp in services_files)
-    services_ai = sum(file_results[fp]["ai_lines"] for fp in services_files)
-    services_pct = round((services_ai / services_total * 100), 2) if services_total > 0 else 0
-    services_pct_str = str(services_pct) + "%"
+    def __init__(self, path: str, limit: int = None, keep: int = max(DETAILS_CONSOLE_MAX, DETAILS_SUMMARY_MAX)):
+        self.path = path
+        self.limit = limit
+        self.keep = keep
+        self.count = 0
+        self.written = 0
+        self.preview = []
+        self._f = open(path, "w", encoding="utf-8")
+
+    def __call__(self, detail: dict):
+        self.count += 1
+        if len(self.preview) < self.keep:
+            self.preview.append(detail)
+        if self.limit is None or self.written < self.limit:
+            self._f.write(json.dumps(detail, ensure_ascii=False) + "\n")
+            self.written += 1
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _json_float(o: float) -> str:
+    """Float text exactly as the json module writes it."""
+    if o != o:
+        return "NaN"
+    if o == float("inf"):
+        return "Infinity"
+    if o == -float("inf"):
+        return "-Infinity"
+    return float.__repr__(o)
+
+
+def _json_key(k) -> str:
+    """Dict key coerced to str the way json.dump does."""
+    if isinstance(k, str):
+        return k
+    if k is True:
+        return "true"
+    if k is False:
+        return "false"
+    if k is None:
+        return "null"
+    if isinstance(k, float):
+        return _json_float(k)
+    if isinstance(k, int):
+        return int.__repr__(k)
+    raise TypeError("keys must be str, int, float, bool or None, not %s" % type(k).__name__)
+
+
+def _encode_indented(o, level: int) -> str:
+    """
+    与 json.dumps(o, indent=2) 逐字节一致的编码（ensure_ascii，嵌套层级从 level 起算）
+    字符串转义走 C 实现，容器直接拼接，比标准库 indent 模式的生成器链快约 2 倍
+    """
+    if isinstance(o, str):
+        return _encode_str(o)
+    if o is None:
+        return "null"
+    if o is True:
+        return "true"
+    if o is False:
+        return "false"
+    if isinstance(o, int):
+        return int.__repr__(o)
+    if isinstance(o, float):
+        return _json_float(o)
+    if isinstance(o, dict):
+        if not o:
+            return "{}"
+        pad = "\n" + "  " * (level + 1)
+        return ("{" + ",".join(pad + _encode_str(_json_key(k)) + ": " + _encode_indented(v, level + 1)
+                               for k, v in o.items()) + "\n" + "  " * level + "}")
+    if isinstance(o, (list, tuple)):
+        if not o:
+            return "[]"
+        pad = "\n" + "  " * (level + 1)
+        return "[" + ",".join(pad + _encode_indented(v, level + 1) for v in o) + "\n" + "  " * level + "]"
+    raise TypeError("Object of type %s is not JSON serializable" % type(o).__name__)
+
+
+def _json_compact_encoder():
+    """encode(o) -> bytes for compact output: orjson when installed, else the stdlib C encoder."""
+    stdlib = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+    ascii_stdlib = json.JSONEncoder(separators=(",", ":"))
+
+    def encode_stdlib(o):
+        try:
+            return stdlib.encode(o).encode("utf-8")
+        except UnicodeEncodeError:
+            # 含代理字符（非 UTF-8 文件名解码而来）时退回 \u 转义
+            return ascii_stdlib.encode(o).encode("ascii")
 
-    # 1b. 当前提交统计（可选）
-    commit_stats = None
-    git_commit = ""
-    git_commit_short = ""
-    if opts.commit:
-        git_commit = _run_git(["git", "rev-parse", "HEAD"], project_root)
-        git_commit_short = _run_git(["git", "rev-parse", "--short", "HEAD"], project_root)
-        commit_stats = compute_commit_stats(opts.base, "HEAD", project_root, file_results)
-
-    # 2. 加载 BOM 并更新匹配的组件
-    bom = {"metadata": {"properties": []}, "components": []}
-    if os.path.exists(input_path):
-        with open(input_path, 'r', encoding='utf-8') as f:
-            bom = json.load(f)
-
-    def set_prop(props: list, name: str, value: str):
-        for p in props:
-            if p.get("name") == name:
-                p["value"] = value
-                return
-        props.append({"name": name, "value": value})
+    try:
+        import orjson
+    except ImportError:
+        return encode_stdlib
 
-    for fp, r in file_results.items():
-        if r["scope"] in ("whole", "partial"):
-            matched = False
-            for comp in bom.get("components", []):
-                cname = comp.get("name", "")
-                if fp in cname or cname.endswith(fp) or os.path.normpath(fp) in os.path.normpath(cname):
+    def encode_orjson(o):
+        try:
+            return orjson.dumps(o)
+        except TypeError:
+            # orjson 不支持的值（超出 64 位的整数、代理字符等）交给标准库
+            return encode_stdlib(o)
+
+    return encode_orjson
+
+
+def _write_json_stream(o, write, encode, level: int = 0, indent: bool = True):
+    """
+    流式写出：顶层对象及其直接子容器（如 components 列表）逐元素编码后写出，
+    内存中只有单个元素的编码结果，不拼接整份文档
+    """
+    if isinstance(o, (dict, list, tuple)) and o and level < 2:
+        is_dict = isinstance(o, dict)
+        pad = ("\n" + "  " * (level + 1)).encode("ascii") if indent else b""
+        write(b"{" if is_dict else b"[")
+        for i, item in enumerate(o.items() if is_dict else o):
+            write(b"," + pad if i else pad)
+            if is_dict:
+                key, item = item
+                write(encode(_json_key(key), level) + (b": " if indent else b":"))
+            _write_json_stream(item, write, encode, level + 1, indent)
+        if indent:
+            write(("\n" + "  " * level).encode("ascii"))
+        write(b"}" if is_dict else b"]")
+    else:
+        write(encode(o, level))
+
+
+def write_bom(bom: dict, output_path: str, compact: bool = False, gzip_output: bool = False) -> str:
+    """
+    流式写出 AIBOM JSON，返回实际写出的路径
+    - 默认 indent=2，与 json.dump(bom, f, indent=2) 逐字节一致
+    - compact：无缩进、非 ASCII 原样输出（UTF-8），安装了 orjson 时用它编码，否则用标准库 C 编码器
+    - gzip_output：写出 <output_path>.gz（mtime 固定为 0，相同内容产物一致）
+    """
+    if compact:
+        encode_compact = _json_compact_encoder()
+
+        def encode(o, level):
+            return encode_compact(o)
+    else:
+        def encode(o, level):
+            return _encode_indented(o, level).encode("ascii")
+
+    if gzip_output:
+        import gzip
+        output_path += ".gz"
+        f = gzip.GzipFile(output_path, "wb", compresslevel=6, mtime=0)
+    else:
+        f = open(output_path, "wb", buffering=1 << 20)
+    with f:
+        _write_json_stream(bom, f.write, encode, indent=not compact)
+    return output_path
+
+
+def _project_properties(totals: ProjectTotals, rollups: list) -> list:
+    """项目累计与各 rollup 的 stats:* 属性（AIBOM metadata 与 watch 模式 /stats 共用）"""
+    ai_pct_str = str(totals.ai_percentage) + "%"
+    props = [
+        {"name": "ai:platform", "value": "Ionic-Universal-Flow"},
+        {"name": "stats:project:src_total_lines", "value": str(totals.total_lines)},
+        {"name": "stats:project:ai_total_lines", "value": str(totals.ai_total_lines)},
+        {"name": "stats:project:ai_whole_file_lines", "value": str(totals.ai_whole_lines)},
+        {"name": "stats:project:ai_partial_lines", "value": str(totals.ai_partial_lines)},
+        {"name": "stats:project:ai_percentage", "value": ai_pct_str},
+        {"name": "stats:project:whole_files_count", "value": str(totals.whole_files_count)},
+        {"name": "stats:project:partial_files_count", "value": str(totals.partial_files_count)},
+        {"name": "stats:project:src_files_scanned", "value": str(totals.files)},
+        {"name": "stats:src_total_lines", "value": str(totals.total_lines)},
+        {"name": "stats:ai_total_lines", "value": str(totals.ai_total_lines)},
+        {"name": "stats:ai_percentage", "value": ai_pct_str},
+    ]
+    for name, _, files_count, r_total, r_ai, r_pct in rollups:
+        props.extend([
+            {"name": "stats:%s:src_total_lines" % name, "value": str(r_total)},
+            {"name": "stats:%s:ai_total_lines" % name, "value": str(r_ai)},
+            {"name": "stats:%s:ai_percentage" % name, "value": str(r_pct) + "%"},
+            {"name": "stats:%s:files_count" % name, "value": str(files_count)},
+        ])
+    return props
+
+
+def build_summary(totals: ProjectTotals, rollups: list, commit_stats, scan_time: str,
+                  git_commit: str = "", git_commit_short: str = "") -> dict:
+    """
+    扁平摘要（--summary-json / --summary-env / --summary-md 共用），值与 AIBOM metadata 属性一致
+    键名沿用 CI 中的环境变量名（小写）；rollup 为 <name>_total / _ai / _pct / _files；
+    未启用 --commit 时提交相关项为 0
+    """
+    summary = {
+        "scan_time": scan_time,
+        "commit": git_commit,
+        "commit_short": git_commit_short,
+        "total_lines": totals.total_lines,
+        "ai_lines": totals.ai_total_lines,
+        "ai_pct": "%s%%" % totals.ai_percentage,
+        "ai_whole_lines": totals.ai_whole_lines,
+        "ai_partial_lines": totals.ai_partial_lines,
+        "whole_files": totals.whole_files_count,
+        "partial_files": totals.partial_files_count,
+        "files_scanned": totals.files,
+    }
+    for name, _, files_count, r_total, r_ai, r_pct in rollups:
+        key = re.sub(r"\W", "_", name).lower()
+        summary.update({key + "_total": r_total, key + "_ai": r_ai, key + "_pct": "%s%%" % r_pct,
+                        key + "_files": files_count})
+    summary.update(commit_ai=0, commit_added=0, commit_pct="0", commit_changed_files=0, commit_ai_changed_files=0)
+    if commit_stats is not None:
+        summary.update(commit_ai=commit_stats["ai_lines"], commit_added=commit_stats["total_added"],
+                       commit_changed_files=commit_stats["changed_files"],
+                       commit_ai_changed_files=commit_stats["ai_changed_files"])
+        if commit_stats["total_added"] > 0:
+            summary["commit_pct"] = "%s%%" % round(commit_stats["ai_lines"] / commit_stats["total_added"] * 100, 2)
+    return summary
+
+
+def write_summary_env(summary: dict, path: str):
+    """追加 KEY=VALUE 行（可直接传 $GITHUB_ENV）"""
+    with open(path, "a", encoding="utf-8") as f:
+        for key, value in summary.items():
+            f.write("%s=%s\n" % (key.upper(), value))
+
+
+def write_summary_json(summary: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+def write_summary_md(summary: dict, rollups: list, config: ScanConfig, commit_stats, path: str,
+                     details: DetailWriter = None):
+    """
+    追加 Markdown 报告（可直接传 $GITHUB_STEP_SUMMARY）；在 GitHub Actions 中附带本次运行链接
+    AI 行明细最多列出 DETAILS_SUMMARY_MAX 条，其余提示见明细文件
+    """
+    run = ""
+    if os.environ.get("GITHUB_RUN_ID") and os.environ.get("GITHUB_REPOSITORY"):
+        run = " | [Workflow run #%s](%s/%s/actions/runs/%s)" % (
+            os.environ.get("GITHUB_RUN_NUMBER", ""), os.environ.get("GITHUB_SERVER_URL", "https://github.com"),
+            os.environ["GITHUB_REPOSITORY"], os.environ["GITHUB_RUN_ID"])
+    lines = [
+        "## 🤖 AI Digital Provenance Report",
+        "",
+        "### ⏱️ Timestamps",
+        "- **AI scan time**: `%s`" % summary["scan_time"],
+        "- **Summary generated**: `%s` (UTC)%s" % (datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), run),
+        "",
+        "### 📊 Project Total (%s full range)" % ", ".join((root or ".") + "/" for root in config.roots),
+        "- **Total lines**: %s | **AI lines**: %s | **Penetration rate**: %s"
+        % (summary["total_lines"], summary["ai_lines"], summary["ai_pct"]),
+    ]
+    for name, prefix, files_count, r_total, r_ai, r_pct in rollups:
+        lines.extend([
+            "",
+            "### 📊 %s (%s)" % (prefix.rstrip("/"), name),
+            "- **Total lines**: %s | **AI lines**: %s | **Penetration rate**: %s%% | **Files**: %s"
+            % (r_total, r_ai, r_pct, files_count),
+        ])
+    if commit_stats is not None:
+        lines.extend([
+            "",
+            "### 📊 Current Commit (diff added)",
+            "- **Lines added**: %s | **AI portion**: %s lines | **Share**: %s"
+            % (summary["commit_added"], summary["commit_ai"], summary["commit_pct"]),
+        ])
+        if details is not None and details.count:
+            lines.extend(["", "<details><summary><strong>📋 AI-generated lines in this PR (%s lines)</strong></summary>"
+                          % summary["commit_ai"], ""])
+            lines.extend("- `%s:%s` %s" % (d["file"], d["line"], d.get("content", ""))
+                         for d in details.preview[:DETAILS_SUMMARY_MAX])
+            if details.count > DETAILS_SUMMARY_MAX:
+                lines.append("- … %s more lines in `%s`" % (details.count - DETAILS_SUMMARY_MAX,
+                                                             os.path.basename(details.path)))
+            lines.extend(["", "</details>"])
+    lines.append("")
+    if summary["ai_lines"] or summary["commit_ai"]:
+        lines.append("⚠️ AI-generated code detected, marked in aibom-final.json")
+    else:
+        lines.append("✅ No AI-attributed code detected")
+    lines.extend(["", "*🎯 AI Digital Provenance - Code transparency and traceability*"])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# ---- 进程内 API：Scanner 可复用地执行扫描，结果为带类型的对象；写出是结果上的可选步骤 ----
+
+class FileResult:
+    """
+    单个文件的分析结果：scope 为 none / whole / partial；ai_ranges 为 AI 区域的 0 起始半开区间
+    （可含空行，ai_lines 只计非空行）；来自分片合并的结果不含 ai_ranges
+    """
+
+    __slots__ = ("path", "scope", "total_lines", "ai_lines", "partial_lines", "ai_ranges")
+
+    def __init__(self, path: str, scope: str = "none", total_lines: int = 0, ai_lines: int = 0,
+                 partial_lines: int = 0, ai_ranges: tuple = ()):
+        self.path = path
+        self.scope = scope
+        self.total_lines = total_lines
+        self.ai_lines = ai_lines
+        self.partial_lines = partial_lines
+        self.ai_ranges = ai_ranges
+
+    @classmethod
+    def from_dict(cls, path: str, r: dict) -> "FileResult":
+        return cls(path, r["scope"], r["total_lines"], r["ai_lines"], r["partial_lines"],
+                   tuple(tuple(x) for x in r.get("ai_ranges") or ()))
+
+    @property
+    def is_ai(self) -> bool:
+        return self.scope != "none"
+
+    def __repr__(self):
+        return "FileResult(%r, scope=%r, total_lines=%s, ai_lines=%s)" % (
+            self.path, self.scope, self.total_lines, self.ai_lines)
+
+
+class CommitStats:
+    """base..head diff 的 AI 统计；details 为未交给 on_detail 时收集的 AI 行明细 [{"file", "line", "content"}]"""
+
+    __slots__ = ("base", "head", "commit", "commit_short", "ai_lines", "total_added", "changed_files",
+                 "ai_changed_files", "details")
+
+    def __init__(self, base: str, head: str, commit: str, commit_short: str, stats: dict):
+        self.base = base
+        self.head = head
+        self.commit = commit
+        self.commit_short = commit_short
+        self.ai_lines = stats["ai_lines"]
+        self.total_added = stats["total_added"]
+        self.changed_files = stats["changed_files"]
+        self.ai_changed_files = stats["ai_changed_files"]
+        self.details = stats.get("ai_line_details", [])
+
+    @property
+    def ai_percentage(self):
+        return round(self.ai_lines / self.total_added * 100, 2) if self.total_added > 0 else 0
+
+    def __repr__(self):
+        return "CommitStats(%r..%r, ai_lines=%s, total_added=%s)" % (
+            self.base, self.head, self.ai_lines, self.total_added)
+
+
+class ScanResult:
+    """
+    一次扫描的结果：totals（ProjectTotals）、files（{路径: FileResult}）、可选的提交统计与 AI 行归属
+    AIBOM / 摘要 / 分片 / 历史都是按需调用的写出步骤，不调用就不产生任何文件
+    file_results / commit_stats 为内部使用的原始 dict（与 analyze_file / compute_commit_stats 的返回一致）
+    """
+
+    __slots__ = ("config", "project_root", "head", "file_results", "totals", "cache_counts", "attribution",
+                 "scan_time", "base", "commit_stats", "git_commit", "git_commit_short", "_read_file", "_files")
+
+    def __init__(self, config: ScanConfig, project_root: str, head: str, file_results: dict,
+                 totals: ProjectTotals = None, cache_counts=None, attribution: Attribution = None, read_file=None):
+        self.config = config
+        self.project_root = project_root
+        self.head = head
+        self.file_results = file_results
+        if totals is None:
+            totals = ProjectTotals()
+            for fp, r in file_results.items():
+                totals.add(fp, r)
+        self.totals = totals
+        self.cache_counts = cache_counts
+        self.attribution = attribution
+        self.scan_time = _utc_iso()
+        self.base = None
+        self.commit_stats = None
+        self.git_commit = ""
+        self.git_commit_short = ""
+        self._read_file = read_file
+        self._files = None
+
+    @property
+    def files(self) -> dict:
+        """{路径: FileResult}，首次访问时构建"""
+        if self._files is None:
+            self._files = {fp: FileResult.from_dict(fp, r) for fp, r in self.file_results.items()}
+        return self._files
+
+    @property
+    def commit(self):
+        """CommitStats；未计算提交统计时为 None"""
+        if self.commit_stats is None:
+            return None
+        return CommitStats(self.base, self.head, self.git_commit, self.git_commit_short, self.commit_stats)
+
+    @property
+    def total_lines(self) -> int:
+        return self.totals.total_lines
+
+    @property
+    def ai_lines(self) -> int:
+        return self.totals.ai_total_lines
+
+    @property
+    def ai_percentage(self):
+        return self.totals.ai_percentage
+
+    @property
+    def rollups(self) -> list:
+        """[(名称, 前缀, 文件数, 总行数, AI 行数, 渗透率)]"""
+        return self.totals.rollups(self.config)
+
+    def properties(self, rollups: list = None) -> list:
+        """AIBOM metadata 属性：项目累计与 rollup、扫描时间，以及提交统计与 AI 行归属（如有）"""
+        props = _project_properties(self.totals, self.rollups if rollups is None else rollups)
+        props.append({"name": "build:scan_time", "value": self.scan_time})
+        commit_stats = self.commit_stats
+        if commit_stats is not None:
+            props.extend([
+                {"name": "git:commit", "value": self.git_commit or "unknown"},
+                {"name": "git:commit_short", "value": self.git_commit_short or "unknown"},
+                {"name": "stats:commit:ai_lines", "value": str(commit_stats["ai_lines"])},
+                {"name": "stats:commit:total_added", "value": str(commit_stats["total_added"])},
+                {"name": "stats:commit:changed_files", "value": str(commit_stats["changed_files"])},
+                {"name": "stats:commit:ai_changed_files", "value": str(commit_stats["ai_changed_files"])},
+            ])
+            if commit_stats["total_added"] > 0:
+                commit_pct = round(commit_stats["ai_lines"] / commit_stats["total_added"] * 100, 2)
+                props.append({"name": "stats:commit:ai_percentage", "value": str(commit_pct) + "%"})
+        if self.attribution is not None:
+            props.extend(self.attribution.properties())
+        return props
+
+    def bom(self, input_path: str = None, rollups: list = None) -> dict:
+        """
+        合并后的 AIBOM：读取 input_path（默认项目根下的 base-sbom.json，不存在时从空 BOM 开始），
+        为 AI 文件的组件设置 ai:* 属性，BOM 中没有的文件注入为 file 组件；metadata.properties 为 properties()
+        """
+        input_path = input_path or os.path.join(self.project_root, BASE_SBOM_FILE)
+        bom = {"metadata": {"properties": []}, "components": []}
+        if os.path.exists(input_path):
+            with open(input_path, 'r', encoding='utf-8') as f:
+                bom = json.load(f)
+
+        def set_prop(props: list, name: str, value: str):
+            for p in props:
+                if p.get("name") == name:
+                    p["value"] = value
+                    return
+            props.append({"name": name, "value": value})
+
+        # 组件名一次性建索引：{AI 文件: [按 BOM 顺序匹配到的组件]}
+        file_results = self.file_results
+        ai_files = [fp for fp, r in file_results.items() if r["scope"] in ("whole", "partial")]
+        path_index = BomPathIndex(ai_files)
+        matches = {}
+
+        def index_component(comp):
+            for fp in path_index.files_in(comp.get("name") or ""):
+                matches.setdefault(fp, []).append(comp)
+
+        for comp in bom.get("components", []):
+            index_component(comp)
+
+        for fp in ai_files:
+            r = file_results[fp]
+            comps = matches.get(fp)
+            if comps:
+                for comp in comps:
                     props = comp.setdefault("properties", [])
                     set_prop(props, "ai:generated", "true")
                     set_prop(props, "ai:scope", r["scope"])
                     set_prop(props, "ai:lines", str(r["ai_lines"]))
-                    matched = True
-            if not matched and bom.get("components") is not None:
-                # BOM 中可能无该文件，注入为 file 组件
-                bom["components"].append({
+            elif bom.get("components") is not None:
+                # BOM 中可能无该文件，注入为 file 组件；注入的组件同样参与后续文件的匹配
+                comp = {
                     "type": "file",
                     "name": fp,
                     "properties": [
@@ -440,54 +2209,192 @@ def process(args=None):
                         {"name": "ai:scope", "value": r["scope"]},
                         {"name": "ai:lines", "value": str(r["ai_lines"])}
                     ]
-                })
+                }
+                bom["components"].append(comp)
+                index_component(comp)
+
+        bom["metadata"]["properties"] = self.properties(rollups)
+        return bom
+
+    def write_bom(self, output_path: str = None, input_path: str = None, compact: bool = False,
+                  gzip_output: bool = False) -> str:
+        """写出 AIBOM（默认项目根下的 aibom-final.json），返回实际路径"""
+        return write_bom(self.bom(input_path), output_path or os.path.join(self.project_root, BOM_FILE),
+                         compact, gzip_output)
+
+    def summary(self, rollups: list = None) -> dict:
+        """扁平摘要（build_summary），可交给 write_summary_env / write_summary_json / write_summary_md"""
+        return build_summary(self.totals, self.rollups if rollups is None else rollups, self.commit_stats,
+                             self.scan_time, self.git_commit, self.git_commit_short)
+
+    def write_shard(self, path: str, details: str = None):
+        """写出 --shard 的部分结果（config.shard 须已设置），供 merge 合并；details 为已写出的 AI 行明细旁路文件"""
+        write_shard(path, self.config, self.file_results, self.commit_stats, self.head, self.git_commit,
+                    self.git_commit_short, self.cache_counts, self.project_root, self.attribution, details)
+
+    def append_history(self, scan_seconds: float = None):
+        """追加一条历史记录到项目根下的 aibom-history.jsonl"""
+        root = self.project_root
+        gc = self.git_commit or _run_git(["git", "rev-parse", self.head], root)
+        gcs = self.git_commit_short or _run_git(["git", "rev-parse", "--short", self.head], root)
+        _append_history(root, self.commit_stats, self.totals.total_lines, self.totals.ai_total_lines, gc, gcs,
+                        scan_seconds)
+
+
+class Scanner:
+    """
+    进程内扫描入口（CLI 同样经由它）：
 
-    # 3. 注入全局统计
-    ai_pct = round((ai_total_lines / total_lines * 100), 2) if total_lines > 0 else 0
-    ai_pct_str = str(ai_pct) + "%"
-    props = [
-        {"name": "ai:platform", "value": "Ionic-Universal-Flow"},
-        {"name": "stats:project:src_total_lines", "value": str(total_lines)},
-        {"name": "stats:project:ai_total_lines", "value": str(ai_total_lines)},
-        {"name": "stats:project:ai_whole_file_lines", "value": str(ai_whole_lines)},
-        {"name": "stats:project:ai_partial_lines", "value": str(ai_partial_lines)},
-        {"name": "stats:project:ai_percentage", "value": ai_pct_str},
-        {"name": "stats:project:whole_files_count", "value": str(whole_files_count)},
-        {"name": "stats:project:partial_files_count", "value": str(partial_files_count)},
-        {"name": "stats:project:src_files_scanned", "value": str(len(src_files))},
-        {"name": "stats:src_total_lines", "value": str(total_lines)},
-        {"name": "stats:ai_total_lines", "value": str(ai_total_lines)},
-        {"name": "stats:ai_percentage", "value": ai_pct_str},
-        {"name": "stats:services:src_total_lines", "value": str(services_total)},
-        {"name": "stats:services:ai_total_lines", "value": str(services_ai)},
-        {"name": "stats:services:ai_percentage", "value": services_pct_str},
-        {"name": "stats:services:files_count", "value": str(len(services_files))},
-        {"name": "build:scan_time", "value": datetime.now().isoformat()},
-    ]
-    if commit_stats is not None:
-        props.extend([
-            {"name": "git:commit", "value": git_commit or "unknown"},
-            {"name": "git:commit_short", "value": git_commit_short or "unknown"},
-            {"name": "stats:commit:ai_lines", "value": str(commit_stats["ai_lines"])},
-            {"name": "stats:commit:total_added", "value": str(commit_stats["total_added"])},
-            {"name": "stats:commit:changed_files", "value": str(commit_stats["changed_files"])},
-            {"name": "stats:commit:ai_changed_files", "value": str(commit_stats["ai_changed_files"])},
-        ])
-        if commit_stats["total_added"] > 0:
-            commit_pct = round(commit_stats["ai_lines"] / commit_stats["total_added"] * 100, 2)
-            props.append({"name": "stats:commit:ai_percentage", "value": str(commit_pct) + "%"})
-    bom["metadata"]["properties"] = props
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(bom, f, indent=2)
-
-    print("📊 [项目累计] src/ 全量统计:")
-    print("   总行数: %s | 扫描文件: %s" % (total_lines, len(src_files)))
-    print("📊 [src/app/services] 子目录统计:")
-    print("   总行数: %s | 文件数: %s | AI 行数: %s | 渗透率: %s%%" % (services_total, len(services_files), services_ai, services_pct))
-    print("   AI 行数: %s (整文件 %s + 片段 %s)" % (ai_total_lines, ai_whole_lines, ai_partial_lines))
-    print("   渗透率: %s%%" % ai_pct)
-    print("   整文件: %s 个 | 部分片段: %s 个" % (whole_files_count, partial_files_count))
+        with Scanner(".") as scanner:
+            result = scanner.scan()                     # 工作区；scan(ref="v1.2.0") 读取指定提交
+            result.ai_percentage, result.files["src/app/a.ts"].ai_lines
+            scanner.scan_commit(result, base="origin/main")
+            result.write_bom()
+
+    同一实例可反复 scan()：分析 / blame 缓存只加载一次并在扫描间复用，--ref 的 git cat-file 进程也常驻复用
+    构造时只读取配置（config 为路径且不存在时抛出 FileNotFoundError，配置无效时抛出 ValueError），
+    不启动 git；close() 结束常驻进程
+    """
+
+    def __init__(self, project_root: str = ".", config=None, jobs: int = None, cache: bool = True,
+                 cache_dir: str = CACHE_DIR):
+        self.project_root = project_root
+        if not isinstance(config, ScanConfig):
+            config = ScanConfig.load(config or os.path.join(project_root, CONFIG_FILE), required=bool(config))
+        self.config = config
+        self.jobs = jobs
+        self.cache_dir = os.path.join(project_root, cache_dir) if cache else None
+        self._cache = None
+        self._blame_cache = None
+        self._blobs = GitBlobReader(project_root)
+
+    def analysis_cache(self):
+        """AnalysisCache（首次使用时加载）；未启用缓存时为 None"""
+        if self._cache is None and self.cache_dir is not None:
+            self._cache = AnalysisCache(self.cache_dir).load()
+        return self._cache
+
+    def blame_cache(self):
+        if self._blame_cache is None and self.cache_dir is not None:
+            self._blame_cache = BlameCache(self.cache_dir).load()
+        return self._blame_cache
+
+    def scan(self, ref: str = None, attribution: bool = False, metrics: Metrics = None,
+             timings: dict = None) -> ScanResult:
+        """
+        扫描配置的根目录（默认 src/）：ref 为 None 时读工作区，否则从对象库读取该提交的文件（不触碰工作区）
+        attribution=True 时对 AI 区间执行 git blame（见 attribute_ai_lines）
+        metrics 记录分阶段耗时，timings 为 dict 时记录每个实际分析文件的耗时；ref 无法解析时抛出 ValueError
+        """
+        project_root = self.project_root
+        config = self.config
+        metrics = metrics or Metrics()
+        metrics.begin("cache_load")
+        cache = self.analysis_cache()
+        hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+        if cache is not None:
+            metrics.count(entries=len(cache.entries))
+        metrics.begin("collect")
+        head = "HEAD"
+        read_file = None
+        if ref:
+            head = resolve_commit(ref, project_root)
+            if not head:
+                raise ValueError("无法解析 ref: %s" % ref)
+            ref_files = list_ref_files(head, project_root, config)
+            src_files = [fp for fp, _ in ref_files]
+            metrics.count(files=len(src_files))
+            metrics.begin("analyze")
+            file_results = analyze_ref_files(ref_files, self._blobs, self.jobs, cache, timings)
+            read_file = self._blobs.reader_for(ref_files)
+        else:
+            src_files = collect_src_files(project_root, config)
+            metrics.count(files=len(src_files))
+            metrics.begin("analyze")
+            file_results = analyze_files(src_files, project_root, self.jobs, cache, timings)
+        cache_counts = None
+        if cache is not None:
+            cache_counts = (cache.hits - hits, cache.misses - misses)
+        metrics.count(files=len(src_files), lines=sum(r["total_lines"] for r in file_results.values()),
+                      analyzed=len(src_files) - (cache_counts[0] if cache_counts is not None else 0))
+        metrics.begin("cache_save")
+        if cache is not None:
+            cache.save()
+        metrics.begin("aggregate")
+        totals = ProjectTotals()
+        for fp in src_files:
+            totals.add(fp, file_results[fp])
+
+        # AI 行归属（可选）：对 AI 区间执行 git blame
+        blamed = None
+        if attribution:
+            metrics.begin("attribution")
+            blame_cache = self.blame_cache()
+            blamed = attribute_ai_lines(file_results, read_file or partial(_read_bytes, project_root=project_root),
+                                        project_root, head if ref else None, self.jobs, blame_cache)
+            if blame_cache is not None:
+                blame_cache.save()
+            metrics.count(files=blamed.files, lines=blamed.ai_lines)
+        return ScanResult(config, project_root, head, file_results, totals, cache_counts, blamed, read_file)
+
+    def scan_commit(self, result: ScanResult, base: str = None, on_detail=None, metrics: Metrics = None) -> CommitStats:
+        """
+        在 scan() 的结果上计算 base..head 的提交统计（base 默认 head~1），写回 result 并返回 CommitStats
+        on_detail 为可调用对象时逐条接收 AI 行明细（如 DetailWriter 流式写出），否则收集在 CommitStats.details
+        """
+        project_root = self.project_root
+        result.git_commit = _run_git(["git", "rev-parse", result.head], project_root)
+        result.git_commit_short = _run_git(["git", "rev-parse", "--short", result.head], project_root)
+        result.base = base or result.head + "~1"
+        result.commit_stats = compute_commit_stats(result.base, result.head, project_root, result.file_results,
+                                                   result._read_file, self.config, on_detail)
+        if metrics is not None:
+            metrics.count(files=result.commit_stats["changed_files"], lines=result.commit_stats["total_added"])
+        return result.commit
+
+    def close(self):
+        self._blobs.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _write_results(opts, result: ScanResult, metrics: Metrics, details: DetailWriter = None):
+    """
+    输出阶段（process 与 merge 共用）：写出 aibom-final.json、控制台报告、摘要，以及可选的历史追加
+    AI 行明细已由 details（DetailWriter）在计算时流式写出，这里只展示前 DETAILS_CONSOLE_MAX 条
+    """
+    instrument = bool(opts.profile or opts.metrics_out)
+    config = result.config
+    totals = result.totals
+    commit_stats = result.commit_stats
+    total_lines = totals.total_lines
+    ai_total_lines = totals.ai_total_lines
+    # 子目录统计（配置的 rollups，默认 services → src/app/services/）：直接查目录前缀表
+    rollups = result.rollups
+
+    metrics.begin("bom_merge")
+    bom = result.bom(rollups=rollups)
+    metrics.count(components=len(bom.get("components") or []))
+
+    metrics.begin("bom_write")
+    output_path = write_bom(bom, _in_root(result.project_root, BOM_FILE), getattr(opts, "compact", False),
+                            getattr(opts, "gzip", False))
+    metrics.begin("report")
+
+    print("📊 [项目累计] %s 全量统计:" % "、".join((root or ".") + "/" for root in config.roots))
+    print("   总行数: %s | 扫描文件: %s" % (total_lines, totals.files))
+    for _, prefix, files_count, r_total, r_ai, r_pct in rollups:
+        print("📊 [%s] 子目录统计:" % prefix.rstrip("/"))
+        print("   总行数: %s | 文件数: %s | AI 行数: %s | 渗透率: %s%%" % (r_total, files_count, r_ai, r_pct))
+    print("   AI 行数: %s (整文件 %s + 片段 %s)" % (ai_total_lines, totals.ai_whole_lines, totals.ai_partial_lines))
+    print("   渗透率: %s%%" % totals.ai_percentage)
+    print("   整文件: %s 个 | 部分片段: %s 个" % (totals.whole_files_count, totals.partial_files_count))
+    if result.cache_counts is not None:
+        print("   分析缓存: 命中 %s | 重新分析 %s" % result.cache_counts)
     if commit_stats is not None:
         print("📊 [当前提交] diff 统计:")
         print("   变更文件: %s 个 | 含 AI: %s 个" % (commit_stats["changed_files"], commit_stats["ai_changed_files"]))
@@ -495,26 +2402,372 @@ def process(args=None):
         if commit_stats["total_added"] > 0:
             cp = round(commit_stats["ai_lines"] / commit_stats["total_added"] * 100, 2)
             print("   本 commit AI 占比: %s%%" % cp)
-        details = commit_stats.get("ai_line_details", [])
-        detail_path = os.path.join(project_root, "commit-ai-lines.json")
-        with open(detail_path, 'w', encoding='utf-8') as f:
-            json.dump(details, f, indent=2, ensure_ascii=False)
-        if details:
-            print("   AI 行明细已写入: %s" % detail_path)
-            for d in details:
+        if details is not None and details.count:
+            if details.written < details.count:
+                print("   AI 行明细已写入: %s（前 %s 条，共 %s 条）" % (details.path, details.written, details.count))
+            else:
+                print("   AI 行明细已写入: %s" % details.path)
+            for d in details.preview[:DETAILS_CONSOLE_MAX]:
                 print("   %s:%s | %s" % (d["file"], d["line"], d.get("content", "")[:60]))
+            if details.count > DETAILS_CONSOLE_MAX:
+                print("   ... 另有 %s 行（见 %s）" % (details.count - DETAILS_CONSOLE_MAX, details.path))
+    if result.attribution is not None:
+        _print_attribution(result.attribution)
     print("✅ AIBOM 已生成: %s" % output_path)
 
-    if opts.append_history and os.path.isdir(os.path.join(project_root, ".git")):
-        gc = git_commit or _run_git(["git", "rev-parse", "HEAD"], project_root)
-        gcs = git_commit_short or _run_git(["git", "rev-parse", "--short", "HEAD"], project_root)
-        _append_history(project_root, commit_stats, total_lines, ai_total_lines, gc, gcs)
+    if opts.summary_env or opts.summary_json or opts.summary_md:
+        summary = result.summary(rollups)
+        if opts.summary_env:
+            write_summary_env(summary, opts.summary_env)
+            print("✅ 摘要（KEY=VALUE）已写入: %s" % opts.summary_env)
+        if opts.summary_json:
+            write_summary_json(summary, opts.summary_json)
+            print("✅ 摘要（JSON）已写入: %s" % opts.summary_json)
+        if opts.summary_md:
+            write_summary_md(summary, rollups, config, commit_stats, opts.summary_md, details)
+            print("✅ 摘要（Markdown）已追加: %s" % opts.summary_md)
+
+    if opts.append_history and os.path.isdir(os.path.join(result.project_root, ".git")):
+        metrics.begin("history")
+        result.append_history(round(metrics.elapsed(), 3) if instrument else None)
 
 
-def _append_history(project_root, commit_stats, proj_total, proj_ai, git_commit, git_commit_short):
-    history_path = os.path.join(project_root, "aibom-history.json")
+def process(args=None):
+    """CLI 的单次运行：经 Scanner 扫描，再按参数写出 AIBOM / 明细 / 摘要 / 历史，或 --shard 的部分结果"""
+    opts = args
+    if opts is None:
+        import argparse
+        opts = argparse.Namespace(project_root=".", commit=False, base=None, ref=None, append_history=False, jobs=None,
+                                  no_cache=False, cache_dir=CACHE_DIR, profile=None, metrics_out=None,
+                                  slowest=10, config=None, shard=None, shard_out=None, summary_env=None,
+                                  summary_json=None, summary_md=None, details_max=None, compact=False,
+                                  gzip=False, attribution=False)
+    project_root = opts.project_root
+    config = _load_cli_config(opts.config, project_root)
+    config.shard = getattr(opts, "shard", None)
+    instrument = bool(opts.profile or opts.metrics_out)
+    metrics = Metrics(opts.slowest)
+    details = None
+    shard_path = None
+    if config.shard is not None:
+        shard_path = opts.shard_out or _in_root(project_root, SHARD_FILE % config.shard)
+
+    # with 保证出错（含 sys.exit）时也结束 git cat-file 常驻进程；扫描与提交统计结束即关闭
+    with Scanner(project_root, config, opts.jobs, not opts.no_cache, opts.cache_dir) as scanner:
+        try:
+            result = scanner.scan(opts.ref, getattr(opts, "attribution", False), metrics,
+                                  metrics.file_times if instrument else None)
+        except ValueError as e:
+            print("❌ %s" % e)
+            sys.exit(1)
+
+        # 当前提交统计（可选）
+        metrics.begin("commit_diff")
+        if opts.commit:
+            # 分片：明细不限条数写到部分结果旁的旁路文件，merge 归并后再按 --details-max 写入明细文件
+            if config.shard is None:
+                details = DetailWriter(_in_root(project_root, DETAILS_FILE), opts.details_max)
+            else:
+                details = DetailWriter(shard_details_path(shard_path))
+            with details:
+                scanner.scan_commit(result, opts.base, details, metrics)
+
+    totals = result.totals
+    if config.shard is not None:
+        # 分片：只写出本分片的部分结果，由 merge 子命令合并出最终产物
+        metrics.begin("shard_write")
+        result.write_shard(shard_path, details.path if details is not None else None)
+        print("📊 [分片 %s/%s] 文件: %s | 总行数: %s | AI 行数: %s"
+              % (config.shard[0], config.shard[1], totals.files, totals.total_lines, totals.ai_total_lines))
+        print("✅ 分片结果已写入: %s" % shard_path)
+    else:
+        _write_results(opts, result, metrics, details)
+    metrics.end()
+
+    if instrument:
+        metrics.print_summary(result.file_results)
+    if opts.metrics_out:
+        cache = scanner.analysis_cache()
+        report = metrics.to_dict(
+            result.file_results,
+            commit=result.git_commit or _run_git(["git", "rev-parse", result.head], project_root) or "unknown",
+            jobs=opts.jobs or os.cpu_count() or 1,
+            files=totals.files,
+            total_lines=totals.total_lines,
+            ai_lines=totals.ai_total_lines,
+            cache={"hits": cache.hits, "misses": cache.misses} if cache is not None else None,
+        )
+        with open(opts.metrics_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print("✅ 性能指标已写入: %s" % opts.metrics_out)
+
+
+def shard_details_path(shard_path: str) -> str:
+    """Side file next to a shard result that holds its AI line details (JSONL)."""
+    return os.path.splitext(shard_path)[0] + ".details.jsonl"
+
+
+def write_shard(path: str, config: ScanConfig, file_results: dict, commit_stats, head: str, git_commit: str,
+                git_commit_short: str, cache_counts=None, project_root: str = ".", attribution: Attribution = None,
+                details: str = None):
+    """
+    写出 --shard 的部分结果：本分片每个文件的 scope / total_lines / ai_lines / partial_lines，
+    本分片变更文件的提交统计（各项可直接相加），以及可选的 AI 行归属
+    AI 行明细不进入部分结果：已由 DetailWriter 流式写到旁路文件 details（按文件有序），这里只记录其文件名
+    """
+    if commit_stats is not None:
+        commit_stats = {key: value for key, value in commit_stats.items() if key != "ai_line_details"}
+    data = {
+        "format": SHARD_FORMAT,
+        "shard": list(config.shard),
+        "config": config.to_dict(),
+        "head": git_commit or resolve_commit(head, project_root),
+        "commit": git_commit,
+        "commit_short": git_commit_short,
+        "cache": list(cache_counts) if cache_counts is not None else None,
+        "files": {fp: {"scope": r["scope"], "total_lines": r["total_lines"], "ai_lines": r["ai_lines"],
+                       "partial_lines": r["partial_lines"]} for fp, r in file_results.items()},
+        "commit_stats": commit_stats,
+        "details": os.path.basename(details) if details else None,
+        "attribution": attribution.to_dict() if attribution is not None else None,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def merge_shards(parts: list):
+    """
+    合并全部分片（须为同一 N 的 1..N 各一份，且 config / head / 是否含提交统计一致）
+    返回 (config, file_results 按路径排序, commit_stats, 首个分片)；不一致时抛出 ValueError
+    """
+    if not parts:
+        raise ValueError("没有分片")
+    first = parts[0]
+    count = first.get("shard", [0, 0])[1]
+    seen = set()
+    for part in parts:
+        if part.get("format") != SHARD_FORMAT:
+            raise ValueError("不是分片结果（format=%s）" % part.get("format"))
+        i, n = part["shard"]
+        if n != count or (i, n) in seen:
+            raise ValueError("分片 %s/%s 重复或与 N=%s 不一致" % (i, n, count))
+        seen.add((i, n))
+        for key in ("config", "head"):
+            if part[key] != first[key]:
+                raise ValueError("分片 %s/%s 与 %s/%s 的 %s 不同" % (i, n, first["shard"][0], count, key))
+        if (part["commit_stats"] is None) != (first["commit_stats"] is None):
+            raise ValueError("部分分片缺少提交统计（--commit 须一致）")
+        if part["commit_stats"] is not None and not part.get("details"):
+            raise ValueError("分片 %s/%s 缺少 AI 行明细文件" % (i, n))
+        if (part.get("attribution") is None) != (first.get("attribution") is None):
+            raise ValueError("部分分片缺少 AI 行归属（--attribution 须一致）")
+    missing = sorted(set(range(1, count + 1)) - {i for i, _ in seen})
+    if missing:
+        raise ValueError("缺少分片: %s" % ", ".join("%d/%d" % (i, count) for i in missing))
+
+    file_results = {}
+    for part in parts:
+        file_results.update(part["files"])
+    file_results = dict(sorted(file_results.items()))
+    commit_stats = None
+    if first["commit_stats"] is not None:
+        commit_stats = {key: sum(part["commit_stats"][key] for part in parts)
+                        for key in ("ai_lines", "total_added", "changed_files", "ai_changed_files")}
+        # 明细由 merge_shard_details 从各分片的旁路文件流式合并
+        commit_stats["ai_line_details"] = []
+    c = first["config"]
+    config = ScanConfig(c["roots"], c["include"], c["exclude"], c["rollups"])
+    return config, file_results, commit_stats, first
+
+
+def _read_details(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def merge_shard_details(paths: list):
+    """
+    把各分片的明细旁路文件合并为一个流（heapq.merge，每个文件同时只读一行）
+    每个文件只属于一个分片、分片内按文件有序，按文件归并即恢复单次运行的顺序（文件有序、文件内按行号）
+    """
+    import heapq
+    return heapq.merge(*(_read_details(path) for path in paths), key=lambda d: d["file"])
+
+
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _utc_iso(dt: datetime = None) -> str:
+    """Aware ISO-8601 timestamp in UTC to the second (default: now); naive input is taken as local time."""
+    dt = datetime.now(timezone.utc) if dt is None else dt
+    return dt.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+
+def _history_key(entry: dict) -> datetime:
+    """History sort key: the timestamp normalised to UTC (naive legacy values read as local time)."""
+    try:
+        return datetime.fromisoformat(str(entry.get("timestamp", ""))).astimezone(timezone.utc)
+    except (ValueError, OverflowError):
+        return _EPOCH
+
+
+class HistoryStore:
+    """
+    追加式历史存储（JSONL，每次运行一行），文件内按时间（归一化到 UTC）有序
+    - 追加只写一行，与历史长度无关；比末条更早的记录（如 backfill 回填）插入到对应位置（整文件重写）
+    - 首次使用时从旧版 aibom-history.json（JSON 数组）迁移；旧文件无法解析时拒绝迁移并保留原文件
+    - 查询：latest(n) 从文件尾部反向读取；query() 按时间范围/commit 前缀流式过滤，损坏行跳过并告警
+    """
+
+    # 反向读取文件尾部时的块大小
+    TAIL_BLOCK = 64 * 1024
+
+    def __init__(self, path: str, legacy_path: str = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.skipped = 0
+
+    def migrate(self) -> bool:
+        """Convert the legacy JSON array into JSONL once; return False if it cannot be parsed."""
+        if os.path.exists(self.path) or not self.legacy_path or not os.path.exists(self.legacy_path):
+            return True
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, list):
+                raise ValueError("expected a JSON array")
+        except (OSError, ValueError) as e:
+            print("⚠️ 旧历史文件无法解析，未迁移（原文件保持不变）: %s (%s)" % (self.legacy_path, e), file=sys.stderr)
+            return False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in data:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        print("✅ 历史已迁移: %s → %s（%d 条）" % (self.legacy_path, self.path, len(data)))
+        return True
+
+    def append(self, entry: dict) -> bool:
+        return self.extend([entry])
+
+    def extend(self, entries: list) -> bool:
+        """Append entries in one write; returns False (writing nothing) if the legacy file cannot be migrated."""
+        if not self.migrate():
+            return False
+        if not entries:
+            return True
+        entries = sorted(entries, key=_history_key)
+        last = self.latest(1)
+        if last and _history_key(entries[0]) < _history_key(last[0]):
+            self._insert_sorted(entries)
+            return True
+        line = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with open(self.path, "a+b") as f:
+            # 上次写入被中断时补齐换行，避免与新记录粘连
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf-8"))
+        return True
+
+    def _insert_sorted(self, entries: list):
+        """Rewrite the file with entries merged in by timestamp (stable; unparseable lines keep their place)."""
+        rows = []
+        key = _EPOCH
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.strip():
+                    continue
+                entry = self._parse(raw)
+                if entry is not None:
+                    key = _history_key(entry)
+                rows.append((key, raw.rstrip(b"\n") + b"\n"))
+        rows.extend((_history_key(e), (json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8")) for e in entries)
+        rows.sort(key=lambda row: row[0])
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.writelines(raw for _, raw in rows)
+        os.replace(tmp, self.path)
+
+    def _parse(self, raw: bytes):
+        raw = raw.strip()
+        if not raw:
+            return None
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            entry = None
+        if not isinstance(entry, dict):
+            self.skipped += 1
+            return None
+        return entry
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for raw in f:
+                entry = self._parse(raw)
+                if entry is not None:
+                    yield entry
+
+    def latest(self, n: int) -> list:
+        """The last n entries, oldest first, reading only the tail of the file."""
+        if n <= 0 or not os.path.exists(self.path):
+            return []
+        out = []
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            rest = b""
+            while pos > 0 and len(out) < n:
+                step = min(self.TAIL_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step) + rest
+                parts = chunk.split(b"\n")
+                # 首段可能是被块边界截断的行，留到下一轮
+                rest = parts[0] if pos > 0 else b""
+                for raw in reversed(parts[1:] if pos > 0 else parts):
+                    entry = self._parse(raw)
+                    if entry is not None:
+                        out.append(entry)
+                        if len(out) == n:
+                            break
+        out.reverse()
+        return out
+
+    def query(self, since: str = None, until: str = None, commit: str = None) -> list:
+        """
+        按条件过滤：since/until 为 UTC 下的 ISO 时间前缀（均含边界，如 2026-02 表示整个二月），
+        commit 为 SHA 前缀；旧版本写入的本地时间戳先归一化到 UTC 再比较
+        """
+        out = []
+        for entry in self:
+            key = _history_key(entry)
+            ts = _utc_iso(key) if key != _EPOCH else str(entry.get("timestamp", ""))
+            if since and ts[:len(since)] < since:
+                continue
+            if until and ts[:len(until)] > until:
+                continue
+            if commit and not str(entry.get("commit", "")).startswith(commit):
+                continue
+            out.append(entry)
+        return out
+
+
+def _history_store(project_root: str) -> HistoryStore:
+    return HistoryStore(os.path.join(project_root, HISTORY_FILE),
+                        os.path.join(project_root, LEGACY_HISTORY_FILE))
+
+
+def _append_history(project_root, commit_stats, proj_total, proj_ai, git_commit, git_commit_short,
+                    scan_seconds=None):
+    store = _history_store(project_root)
     entry = {
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": _utc_iso(),
         "commit": git_commit or "unknown",
         "commit_short": git_commit_short or "unknown",
         "project_total_lines": proj_total,
@@ -525,26 +2778,680 @@ def _append_history(project_root, commit_stats, proj_total, proj_ai, git_commit,
         entry["commit_ai_lines"] = commit_stats["ai_lines"]
         entry["commit_total_added"] = commit_stats["total_added"]
         entry["commit_changed_files"] = commit_stats["changed_files"]
-    data = []
-    if os.path.exists(history_path):
+    if scan_seconds is not None:
+        entry["scan_seconds"] = scan_seconds
+    if store.append(entry):
+        print("✅ 历史已追加: %s" % store.path)
+    else:
+        print("⚠️ 历史未追加：请先修复或移走 %s" % store.legacy_path)
+
+
+def history_command(args):
+    """history 子命令：查询历史记录（最近 N 条 / 时间范围 / commit）"""
+    store = _history_store(args.project_root)
+    if not store.migrate():
+        return 1
+    if args.since or args.until or args.commit:
+        entries = store.query(args.since, args.until, args.commit)
+        if args.latest:
+            entries = entries[-args.latest:]
+    else:
+        entries = store.latest(args.latest or 10)
+    if store.skipped:
+        print("⚠️ 跳过 %d 行无法解析的记录: %s" % (store.skipped, store.path), file=sys.stderr)
+    _print_history(entries, args.format)
+    return 0
+
+
+def _print_history(entries: list, fmt: str):
+    if fmt == "jsonl":
+        for entry in entries:
+            print(json.dumps(entry, ensure_ascii=False))
+        return
+    print("%-26s %-9s %10s %8s %8s %10s" % ("timestamp", "commit", "total", "ai", "ai%", "commit_ai"))
+    for e in entries:
+        print("%-26s %-9s %10s %8s %8s %10s" % (
+            e.get("timestamp", ""), e.get("commit_short", ""), e.get("project_total_lines", ""),
+            e.get("project_ai_lines", ""), e.get("project_ai_percentage", ""), e.get("commit_ai_lines", "-")))
+
+
+def merge_command(args):
+    """merge 子命令：合并 --shard 的部分结果，产出与单次运行相同的 aibom-final.json / 明细 / 历史"""
+    import argparse
+    parts = []
+    for path in args.parts:
         try:
-            with open(history_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
+            with open(path, "r", encoding="utf-8") as f:
+                parts.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print("❌ 无法读取分片结果: %s (%s)" % (path, e))
+            return 1
+    try:
+        config, file_results, commit_stats, first = merge_shards(parts)
+    except (ValueError, KeyError, TypeError) as e:
+        print("❌ 分片结果无法合并: %s" % e)
+        return 1
+    caches = [part["cache"] for part in parts]
+    cache_counts = None
+    if all(c is not None for c in caches):
+        cache_counts = (sum(c[0] for c in caches), sum(c[1] for c in caches))
+    attribution = None
+    if first.get("attribution") is not None:
+        attribution = Attribution()
+        for part in parts:
+            attribution.update(part["attribution"])
+    result = ScanResult(config, args.project_root, first["head"] or "HEAD", file_results, cache_counts=cache_counts,
+                        attribution=attribution)
+    result.commit_stats = commit_stats
+    result.git_commit = first["commit"]
+    result.git_commit_short = first["commit_short"]
+    details = None
+    if commit_stats is not None:
+        detail_paths = [os.path.join(os.path.dirname(path), part["details"]) for path, part in zip(args.parts, parts)]
+        missing = [path for path in detail_paths if not os.path.isfile(path)]
+        if missing:
+            print("❌ 缺少分片的 AI 行明细文件: %s" % ", ".join(missing))
+            return 1
+        with DetailWriter(_in_root(args.project_root, DETAILS_FILE), args.details_max) as details:
+            for d in merge_shard_details(detail_paths):
+                details(d)
+    opts = argparse.Namespace(append_history=args.append_history, profile=None, metrics_out=None,
+                              summary_env=args.summary_env, summary_json=args.summary_json, summary_md=args.summary_md,
+                              compact=args.compact, gzip=args.gzip)
+    _write_results(opts, result, Metrics(), details)
+    return 0
+
+
+def walk_history(rev_range: str, project_root: str = ".", config: ScanConfig = None) -> list:
+    """
+    单个 `git log --first-parent -m --raw -z` 进程按时间正序遍历 rev_range 的主线提交
+    返回 [(commit SHA, 提交时间, {路径: 新 blob SHA，删除为 None})]，只含扫描范围（config）内的源文件
+    不加路径过滤，未改动 src 的提交同样出现（变更为空）；合并提交取相对第一父提交的变更
+    """
+    import subprocess
+    config = config or ScanConfig()
+    cmd = ["git", "log", "--reverse", "--first-parent", "-m", "--root", "--raw", "-z", "--no-renames",
+           "--no-abbrev", "--format=%x01%H %cI", rev_range, "--"]
+    try:
+        with GIT_STATS.track():
+            raw = subprocess.run(cmd, cwd=project_root, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    commits = []
+    changes = None
+    tokens = iter(raw.split(b"\0"))
+    for tok in tokens:
+        tok = tok.lstrip(b"\n")
+        if tok.startswith(b"\x01"):
+            sha, _, date = tok[1:].decode("ascii").partition(" ")
+            changes = {}
+            commits.append((sha, date, changes))
+        elif tok.startswith(b":") and changes is not None:
+            path = os.fsdecode(next(tokens, b""))
+            if not config.matches(path):
+                continue
+            _, new_mode, _, new_sha, status = tok[1:].split()
+            # 与 list_ref_files 一致：符号链接、子模块视同不存在
+            if status.startswith(b"D") or new_mode in (b"120000", b"160000"):
+                changes[path] = None
+            else:
+                changes[path] = new_sha.decode("ascii")
+    return commits
+
+
+def backfill(rev_range: str, project_root: str = ".", jobs=None, cache=None, config: ScanConfig = None) -> list:
+    """
+    回填 rev_range 内每个主线提交的项目累计统计，返回与 --append-history 同结构的记录（timestamp 为提交时间）
+    - 起点提交的父提交做一次 ls-tree 得到初始文件表，之后只按每个提交的 raw diff 增量更新 {路径: blob}
+    - 每个 (路径规则, blob) 只分析一次：先查 cache，其余经单个 cat-file 进程分批流式读取、并行分析
+    - 各提交的总行数/AI 行数按变更文件增减，无需逐提交全量扫描
+    """
+    commits = walk_history(rev_range, project_root, config)
+    if not commits:
+        return []
+    if cache is None:
+        cache = AnalysisCache(os.path.join(project_root, CACHE_DIR))
+    parent = resolve_commit(commits[0][0] + "^", project_root)
+    tree = dict(list_ref_files(parent, project_root, config)) if parent else {}
+
+    # 1. 汇总全部需要的 blob，已缓存的直接取结果，其余分批分析
+    memo = {}
+    pending = []
+    wanted = list(tree.items())
+    for _, _, changes in commits:
+        wanted.extend((fp, sha) for fp, sha in changes.items() if sha)
+    for fp, sha in wanted:
+        key = cache.key(fp, sha)
+        if key in memo:
+            continue
+        r = cache.get(key)
+        memo[key] = r
+        if r is None:
+            pending.append((fp, sha))
+
+    with GitBlobReader(project_root) as blobs:
+        for batch in _batched(pending, ANALYSIS_BATCH):
+            items = list(zip([fp for fp, _ in batch], blobs.read_many([sha for _, sha in batch])))
+            for (fp, sha), (_, data), r in zip(batch, items, _map_analysis(_analyze_blob, items, jobs)):
+                memo[cache.key(fp, sha)] = r
+                if data is not None:
+                    cache.put(cache.key(fp, sha), r)
+
+    def counts(fp, sha):
+        r = memo[cache.key(fp, sha)]
+        return r["total_lines"], r["ai_lines"] if r["scope"] in ("whole", "partial") else 0
+
+    # 2. 按提交顺序增量累加
+    short_len = len(_run_git(["git", "rev-parse", "--short", commits[-1][0]], project_root)) or 7
+    current = {fp: counts(fp, sha) for fp, sha in tree.items()}
+    total = sum(t for t, _ in current.values())
+    ai = sum(a for _, a in current.values())
+    entries = []
+    for commit, date, changes in commits:
+        for fp, sha in changes.items():
+            old = current.pop(fp, None)
+            if old is not None:
+                total -= old[0]
+                ai -= old[1]
+            if sha:
+                new = current[fp] = counts(fp, sha)
+                total += new[0]
+                ai += new[1]
+        entries.append({
+            "timestamp": _utc_iso(datetime.fromisoformat(date)),
+            "commit": commit,
+            "commit_short": commit[:short_len],
+            "project_total_lines": total,
+            "project_ai_lines": ai,
+            "project_ai_percentage": round(ai / total * 100, 2) if total > 0 else 0,
+        })
+    return entries
+
+
+def backfill_command(args):
+    """backfill 子命令：回填提交范围内每个提交的项目累计统计，可选追加到历史"""
+    cache = AnalysisCache(os.path.join(args.project_root, args.cache_dir))
+    if not args.no_cache:
+        cache.load()
+    config = _load_cli_config(args.config, args.project_root)
+    entries = backfill(args.range, args.project_root, args.jobs, cache, config)
+    if not args.no_cache:
+        cache.save()
+    if not entries:
+        print("❌ 范围内没有提交或无法解析: %s" % args.range, file=sys.stderr)
+        return 1
+    _print_history(entries, args.format)
+    print("📊 [backfill] %d 个提交 | 分析 blob: 命中缓存 %s | 新分析 %s"
+          % (len(entries), cache.hits, cache.misses), file=sys.stderr)
+    if args.append_history:
+        store = _history_store(args.project_root)
+        if not store.migrate():
+            return 1
+        known = {e.get("commit") for e in store}
+        new = [e for e in entries if e["commit"] not in known]
+        if not store.extend(new):
+            return 1
+        print("✅ 历史已追加 %d 条（跳过已有 %d 条）: %s" % (len(new), len(entries) - len(new), store.path),
+              file=sys.stderr)
+    return 0
+
+
+class _WatchOverflow(Exception):
+    """inotify event queue overflowed; changes may have been lost."""
+
+
+class _InotifyWatcher:
+    """
+    Linux inotify（ctypes 调用 libc，无第三方依赖）：递归监听扫描根下的所有目录
+    wait() 返回 (变更路径集合 | None 表示需全部重新分析, 文件集合是否可能变化)
+    """
+
+    _MASK = 0x2 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800  # MODIFY CLOSE_WRITE MOVED_* CREATE DELETE *_SELF
+    _Q_OVERFLOW = 0x4000
+    _IGNORED = 0x8000
+    _ISDIR = 0x40000000
+    _MEMBERSHIP = 0x40 | 0x80 | 0x100 | 0x200
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, project_root: str, config: ScanConfig, settle: float = 0.2):
+        import ctypes
+        import ctypes.util
+        self.project_root = project_root
+        self.config = config
+        self.settle = settle
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("libc 不支持 inotify")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.dirs = {}
+        try:
+            for root in config.roots:
+                self._watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, rel_dir: str):
+        import ctypes
+        top = os.path.join(self.project_root, rel_dir)
+        for dirpath, dirnames, _ in os.walk(top):
+            rel = os.path.relpath(dirpath, self.project_root).replace(os.sep, "/")
+            prefix = "" if rel == "." else rel + "/"
+            dirnames[:] = [d for d in dirnames if d != ".git" and not _prunes_dir(self.config.exclude, prefix + d)]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self._MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # 目录在遍历过程中被删除时忽略；watch 数达到上限（ENOSPC）等交给调用方回退轮询
+                if err == errno.ENOENT:
+                    continue
+                raise OSError(err, "inotify_add_watch %s: %s" % (rel, os.strerror(err)))
+            self.dirs[wd] = prefix
+
+    def _read_events(self, changed: set) -> bool:
+        """Drain pending events into changed; returns whether files may have been added or removed."""
+        membership = False
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return membership
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, length = self._EVENT.unpack_from(buf, pos)
+                name = os.fsdecode(buf[pos + 16:pos + 16 + length].rstrip(b"\0"))
+                pos += 16 + length
+                if mask & self._Q_OVERFLOW:
+                    raise _WatchOverflow()
+                if mask & self._IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                base = self.dirs.get(wd)
+                if base is None or not name:
+                    continue
+                path = base + name
+                if mask & self._ISDIR:
+                    membership = True
+                    if mask & (0x80 | 0x100):
+                        # 新建/移入的目录：补充监听，其中已有的文件由重新枚举发现
+                        self._watch_tree(path)
+                    continue
+                if mask & self._MEMBERSHIP:
+                    membership = True
+                changed.add(path)
+
+    def wait(self, timeout: float):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set(), False
+        changed = set()
+        membership = False
+        try:
+            # 事件到达后再等 settle 秒，把编辑器保存/git checkout 产生的一串事件合成一批
+            while ready:
+                membership |= self._read_events(changed)
+                ready, _, _ = select.select([self.fd], [], [], self.settle)
+        except _WatchOverflow:
+            return None, True
+        return changed, membership
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _PollWatcher:
+    """轮询后备：每次 wait() 睡眠后重新枚举文件（git ls-files），按 (mtime_ns, size) 找出变化"""
+
+    def __init__(self, project_root: str, config: ScanConfig):
+        self.project_root = project_root
+        self.config = config
+        self.signatures = self._snapshot()
+
+    def _snapshot(self) -> dict:
+        sigs = {}
+        for fp in collect_src_files(self.project_root, self.config):
+            try:
+                st = os.stat(os.path.join(self.project_root, fp))
+            except OSError:
+                continue
+            sigs[fp] = (st.st_mtime_ns, st.st_size)
+        return sigs
+
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+        old, self.signatures = self.signatures, self._snapshot()
+        changed = {fp for fp, sig in self.signatures.items() if old.get(fp) != sig}
+        removed = old.keys() - self.signatures.keys()
+        return changed | removed, bool(removed) or any(fp not in old for fp in changed)
+
+    def close(self):
+        pass
+
+
+class WatchState:
+    """
+    watch 模式的内存状态：file_results 常驻内存，变更时只重新分析受影响的文件，
+    ProjectTotals 先减旧结果再加新结果；/stats 的 JSON 每次更新后序列化一次，请求直接返回
+    HTTP 服务线程运行期间也会重新分析，进程池一律用 spawn 启动（不 fork 持有锁的多线程进程）
+    """
+
+    def __init__(self, project_root: str, config: ScanConfig, jobs=None, cache=None):
+        self.project_root = project_root
+        self.config = config
+        self.jobs = jobs
+        self.cache = cache
+        self.file_results = {}
+        self.totals = ProjectTotals()
+        self.generation = 0
+        self.last_update = None
+        self.epoch = "%x" % int(time.time())
+        # (etag, body)：整体替换，HTTP 线程无需加锁即可读到一致的快照
+        self.snapshot = None
+
+    def rescan(self) -> int:
+        """Full enumeration and analysis (startup, or after lost events)."""
+        started = time.perf_counter()
+        files = collect_src_files(self.project_root, self.config)
+        self.file_results = analyze_files(files, self.project_root, self.jobs, self.cache, mp_context="spawn")
+        self.totals = ProjectTotals()
+        for fp in files:
+            self.totals.add(fp, self.file_results[fp])
+        self._publish(len(files), time.perf_counter() - started)
+        return len(files)
+
+    def apply(self, changed: set, membership: bool) -> int:
+        """
+        增量更新：membership 为 True 时重新枚举文件（新增/删除/.gitignore 变化），否则只看 changed 中已在扫描集合内的文件
+        返回重新分析或移除的文件数；没有相关变化时不发布新版本
+        """
+        started = time.perf_counter()
+        removed = []
+        if membership:
+            current = set(collect_src_files(self.project_root, self.config))
+            removed = [fp for fp in self.file_results if fp not in current]
+            changed = (changed & current) | (current - self.file_results.keys())
+        else:
+            changed = {fp for fp in changed if fp in self.file_results}
+        if not changed and not removed:
+            return 0
+        added = changed - self.file_results.keys()
+        for fp in removed:
+            self.totals.remove(fp, self.file_results.pop(fp))
+        for fp, r in analyze_files(sorted(changed), self.project_root, self.jobs, self.cache,
+                                   mp_context="spawn").items():
+            old = self.file_results.get(fp)
+            if old is not None:
+                self.totals.remove(fp, old)
+            self.file_results[fp] = r
+            self.totals.add(fp, r)
+        if added:
+            self.file_results = dict(sorted(self.file_results.items()))
+        self._publish(len(changed) + len(removed), time.perf_counter() - started)
+        return len(changed) + len(removed)
+
+    def stats(self) -> dict:
+        props = _project_properties(self.totals, self.totals.rollups(self.config))
+        return {p["name"]: p["value"] for p in props}
+
+    def _publish(self, files_updated: int, seconds: float):
+        self.generation += 1
+        self.last_update = {"files": files_updated, "seconds": round(seconds, 3)}
+        body = {
+            "generation": self.generation,
+            "updated_at": _utc_iso(),
+            "last_update": self.last_update,
+            "stats": self.stats(),
+            "ai_files": [fp for fp, r in self.file_results.items() if r["scope"] in ("whole", "partial")],
+        }
+        self.snapshot = ('"%s-%d"' % (self.epoch, self.generation),
+                         json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+
+def _serve_stats(state: WatchState, host: str, port: int, allow_origin: str = None):
+    """
+    在后台线程启动 localhost HTTP/JSON 服务：GET /stats（支持 ETag/304）、GET /history
+    默认不发送 CORS 头；allow_origin 显式指定时才允许该来源跨域读取
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, body: bytes = b"", etag: str = None):
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            if allow_origin:
+                self.send_header("Access-Control-Allow-Origin", allow_origin)
+                self.send_header("Vary", "Origin")
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/stats":
+                etag, body = state.snapshot
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, etag=etag)
+                else:
+                    self._send(200, body, etag)
+            elif url.path == "/history":
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                store = _history_store(state.project_root)
+                try:
+                    n = int(query.get("n", 0))
+                except ValueError:
+                    n = 0
+                if query.get("since") or query.get("until") or query.get("commit"):
+                    entries = store.query(query.get("since"), query.get("until"), query.get("commit"))
+                    entries = entries[-n:] if n else entries
+                else:
+                    entries = store.latest(n or 50)
+                self._send(200, json.dumps(entries, ensure_ascii=False).encode("utf-8"))
+            else:
+                self._send(404, b'{"error": "not found"}')
+
+        def log_message(self, fmt, *args):
             pass
-    data.append(entry)
-    with open(history_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    print("✅ 历史已追加: %s" % history_path)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="aibom-http", daemon=True).start()
+    return server
+
+
+def _print_watch(state: WatchState, label: str):
+    stats = state.stats()
+    print("📊 [watch] %s %s 个文件（%.3fs）| 总行数 %s | AI 行数 %s | 渗透率 %s"
+          % (label, state.last_update["files"], state.last_update["seconds"], stats["stats:project:src_total_lines"],
+             stats["stats:project:ai_total_lines"], stats["stats:project:ai_percentage"]))
+
+
+def watch_command(args):
+    """watch 子命令：常驻进程，监听文件变化增量重算，并在本地 HTTP 端点提供统计与历史"""
+    config = _load_cli_config(args.config, args.project_root)
+    cache = None
+    if not args.no_cache:
+        cache = AnalysisCache(os.path.join(args.project_root, args.cache_dir)).load()
+    state = WatchState(args.project_root, config, args.jobs, cache)
+    state.rescan()
+    if cache is not None:
+        cache.save()
+    _print_watch(state, "初始扫描")
+
+    watcher = None
+    if not args.poll:
+        try:
+            watcher = _InotifyWatcher(args.project_root, config)
+        except OSError as e:
+            print("⚠️ inotify 不可用（%s），改用轮询（间隔 %ss）" % (e, args.interval))
+    if watcher is None:
+        watcher = _PollWatcher(args.project_root, config)
+    try:
+        server = _serve_stats(state, args.host, args.port, args.allow_origin)
+    except OSError as e:
+        watcher.close()
+        print("❌ 无法监听 %s:%s (%s)" % (args.host, args.port, e))
+        return 1
+    print("✅ 统计端点: http://%s:%s/stats | 历史: http://%s:%s/history?n=20（Ctrl+C 退出）"
+          % (args.host, server.server_address[1], args.host, server.server_address[1]))
+
+    try:
+        while True:
+            changed, membership = watcher.wait(args.interval)
+            if changed is None:
+                print("⚠️ 事件队列溢出，重新全量扫描")
+                state.rescan()
+            elif changed or membership:
+                if not state.apply(changed, membership):
+                    continue
+            else:
+                continue
+            _print_watch(state, datetime.now().strftime("%H:%M:%S") + " 更新")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        watcher.close()
+        if cache is not None:
+            cache.save()
+    return 0
+
+
+def _add_output_args(parser):
+    parser.add_argument("--summary-env", metavar="PATH",
+                        help="追加 KEY=VALUE 摘要（如 $GITHUB_ENV），键名 AI_LINES / AI_PCT / TOTAL_LINES / COMMIT_AI ...")
+    parser.add_argument("--summary-json", metavar="PATH", help="写出扁平 JSON 摘要")
+    parser.add_argument("--details-max", type=int, metavar="N",
+                        help="%s 最多写入 N 条 AI 行明细（默认不限；统计不受影响）" % DETAILS_FILE)
+    parser.add_argument("--summary-md", metavar="PATH",
+                        help="追加 Markdown 报告（如 $GITHUB_STEP_SUMMARY）")
+    parser.add_argument("--compact", action="store_true",
+                        help="AIBOM 不缩进、非 ASCII 原样输出（装有 orjson 时用其编码），体积与耗时更小")
+    parser.add_argument("--gzip", action="store_true", help="AIBOM 写为 aibom-final.json.gz")
+
+
+def _shared_parsers(argument_default=None) -> dict:
+    """
+    顶层与子命令共用的选项，各只定义一次，返回 {组名: 父解析器}（root / scan / history / output）
+    子命令侧以 argument_default=argparse.SUPPRESS 构造：子命令后未给出的选项不写入结果，
+    写在子命令之前的同名顶层选项因此不会被子命令的默认值覆盖
+    """
+    import argparse
+    groups = {name: argparse.ArgumentParser(add_help=False, argument_default=argument_default)
+              for name in ("root", "scan", "history", "output")}
+    groups["root"].add_argument("--project-root", metavar="DIR", help="项目根目录，默认当前目录")
+    scan = groups["scan"]
+    scan.add_argument("--jobs", "-j", type=int, metavar="N", help="并行分析的进程数，默认 CPU 核数；1 表示串行")
+    scan.add_argument("--no-cache", action="store_true", help="不读写分析缓存，全量重新分析")
+    scan.add_argument("--cache-dir", metavar="DIR", help="分析缓存目录（相对项目根），默认 %s" % CACHE_DIR)
+    scan.add_argument("--config", metavar="PATH",
+                      help="扫描配置 JSON（roots / include / exclude / rollups），默认读取项目根下的 %s（可不存在）"
+                      % CONFIG_FILE)
+    groups["history"].add_argument("--append-history", action="store_true",
+                                   help="追加本次统计到 %s" % HISTORY_FILE)
+    _add_output_args(groups["output"])
+    if argument_default is None:
+        groups["root"].set_defaults(project_root=".")
+        scan.set_defaults(cache_dir=CACHE_DIR)
+    return groups
+
+
+def _in_root(project_root: str, name: str) -> str:
+    """Path of an artifact under the project root (plain relative name for the default root)."""
+    return os.path.normpath(os.path.join(project_root, name))
+
+
+def _load_cli_config(path, project_root: str = ".") -> ScanConfig:
+    """CLI 入口读取 --config（缺省为项目根下的 aibom.config.json）：出错时打印并退出"""
+    try:
+        return ScanConfig.load(path or os.path.join(project_root, CONFIG_FILE), required=bool(path))
+    except (FileNotFoundError, ValueError) as e:
+        print("❌ %s" % e)
+        sys.exit(1)
+
+
+def _shard_arg(value: str) -> tuple:
+    import argparse
+    m = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise argparse.ArgumentTypeError("应为 I/N 且 1 ≤ I ≤ N，如 2/4")
+    return int(m.group(1)), int(m.group(2))
 
 
 def main():
-    parser = argparse.ArgumentParser(description="AIBOM 全量统计（项目累计 + 当前提交）")
+    import argparse
+    shared = _shared_parsers()
+    sub_shared = _shared_parsers(argparse.SUPPRESS)
+    parser = argparse.ArgumentParser(description="AIBOM 全量统计（项目累计 + 当前提交）",
+                                     parents=[shared[name] for name in ("root", "scan", "history", "output")])
     parser.add_argument("--commit", action="store_true", help="启用当前提交 diff 统计")
-    parser.add_argument("--base", default="HEAD~1", help="diff 基准 ref，默认 HEAD~1")
-    parser.add_argument("--append-history", action="store_true", help="追加本次统计到 aibom-history.json")
+    parser.add_argument("--base", default=None, help="diff 基准 ref，默认 HEAD~1（--ref 时为 <ref>~1）")
+    parser.add_argument("--ref", default=None, metavar="REV",
+                        help="直接分析指定提交（从 git 对象库读取，无需 checkout），默认分析工作区")
+    parser.add_argument("--metrics-out", default=None, metavar="PATH",
+                        help="写出分阶段性能指标 JSON（墙钟/CPU、文件/行数、git 调用、最慢文件）")
+    parser.add_argument("--profile", nargs="?", const=PROFILE_FILE, default=None, metavar="PATH",
+                        help="用 cProfile 剖析主进程并写出 pstats（默认 %s），同时打印分阶段耗时" % PROFILE_FILE)
+    parser.add_argument("--shard", type=_shard_arg, default=None, metavar="I/N",
+                        help="只分析第 I 个分片（共 N 个，按路径哈希稳定分配），写出部分结果供 merge 合并")
+    parser.add_argument("--shard-out", default=None, metavar="PATH",
+                        help="分片部分结果路径，默认 %s" % (SHARD_FILE.replace("%d", "{I}", 1).replace("%d", "{N}")))
+    parser.add_argument("--slowest", type=int, default=10, metavar="N", help="指标中列出最慢的 N 个文件，默认 10")
+    parser.add_argument("--attribution", action="store_true",
+                        help="对 AI 区间执行 git blame，按引入提交 / 作者汇总 AI 行（结果按 blob 缓存）")
+
+    sub = parser.add_subparsers(dest="command")
+    p_hist = sub.add_parser("history", help="查询 %s 中的历史记录" % HISTORY_FILE, parents=[sub_shared["root"]])
+    p_hist.add_argument("--latest", "-n", type=int, default=None, metavar="N",
+                        help="最近 N 条（默认 10；与过滤条件同用时取结果的最后 N 条）")
+    p_hist.add_argument("--since", default=None, help="起始时间（UTC 下的 ISO 前缀，含），如 2026-02-01")
+    p_hist.add_argument("--until", default=None, help="结束时间（UTC 下的 ISO 前缀，含），如 2026-02")
+    p_hist.add_argument("--commit", default=None, help="按 commit SHA 前缀过滤")
+    p_hist.add_argument("--format", choices=("table", "jsonl"), default="table", help="输出格式，默认 table")
+    p_back = sub.add_parser("backfill", help="回填提交范围内每个提交的项目累计统计（--append-history 时已存在的 commit 跳过）",
+                            parents=[sub_shared[name] for name in ("root", "scan", "history")])
+    p_back.add_argument("range", help="git 提交范围（沿第一父提交），如 v1.0..HEAD；单个 rev 表示其全部祖先")
+    p_back.add_argument("--format", choices=("table", "jsonl"), default="table", help="输出格式，默认 table")
+    p_merge = sub.add_parser("merge", help="合并 --shard 部分结果，生成与单次运行相同的产物",
+                             parents=[sub_shared[name] for name in ("root", "history", "output")])
+    p_merge.add_argument("parts", nargs="+", metavar="SHARD_JSON", help="全部 N 个分片结果")
+    p_watch = sub.add_parser("watch", help="常驻监听源码变化，增量重算并通过本地 HTTP 端点提供统计",
+                             parents=[sub_shared[name] for name in ("root", "scan")])
+    p_watch.add_argument("--host", default="127.0.0.1", help="HTTP 监听地址，默认 127.0.0.1")
+    p_watch.add_argument("--port", type=int, default=WATCH_PORT, help="HTTP 端口，默认 %s（0 表示随机）" % WATCH_PORT)
+    p_watch.add_argument("--allow-origin", default=None, metavar="ORIGIN",
+                         help="允许该来源跨域读取端点（如 http://localhost:3000），默认不发送 CORS 头")
+    p_watch.add_argument("--poll", action="store_true", help="强制使用轮询（默认优先 inotify）")
+    p_watch.add_argument("--interval", type=float, default=2.0, metavar="SEC", help="轮询间隔秒数，默认 2")
     args = parser.parse_args()
-    process(args)
+    if args.command == "merge":
+        sys.exit(merge_command(args))
+    if args.command == "watch":
+        sys.exit(watch_command(args))
+    if args.command == "history":
+        sys.exit(history_command(args))
+    if args.command == "backfill":
+        sys.exit(backfill_command(args))
+    if not args.profile:
+        process(args)
+        return
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        process(args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print("✅ cProfile 结果已写入: %s（python3 -m pstats %s 查看）" % (args.profile, args.profile))
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
 
 
 if __name__ == "__main__":